@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""
+BackendPool: spreads requests over several (endpoint, api key, model) backends.
+
+One api key's rate limit caps throughput no matter how much concurrency is added; a pool of
+keys and endpoints lifts that cap.
+
+- Every Backend owns its own OpenAI client (and keep-alive connection pool), rate budget,
+  in-flight count and health state.
+- Weighted least-loaded selection: among the healthy backends with a free rate slot, the one
+  with the fewest in-flight requests per unit of weight is picked.
+- A backend's `max_concurrency` is a hard cap: when every usable backend is at its cap,
+  `acquire` waits for one of them to finish a request.
+- Passive health checks: after `failure_threshold` consecutive failures (429, 5xx, timeouts,
+  connection errors) a backend is ejected for `ejection_seconds`, doubled at every ejection in
+  a row up to `max_ejection_seconds`. Once that time is over it is re-admitted on probation:
+  one success makes it healthy again, one failure ejects it again.
+- A backend rejecting its credentials is disabled for the rest of the run.
+- If every backend is ejected, the one coming back first is used anyway rather than stalling.
+"""
+
+import logging
+import threading
+import time
+import httpx
+import openai
+from rate_limiter import RateLimiter
+
+class Backend:
+    def __init__(self, name, api_key, model, base_url=None, weight=1.0, requests_per_minute=None,
+                 max_concurrency=None, max_connections=8):
+        """
+        :param name: Label used in logs and metrics.
+        :param weight: Share of the traffic relative to the other backends.
+        :param requests_per_minute: Rate budget of this backend's api key. 0 or None means unlimited.
+        :param max_concurrency: Optional cap on this backend's in-flight requests, never exceeded.
+        :param max_connections: Size of this backend's keep-alive connection pool.
+        """
+        if api_key == "YOUR-OPENAI-API-KEY" or api_key == "":
+            raise ValueError(f"You need to define an OpenAI api key (backend {name})")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f"max_concurrency of backend {name} must be at least 1, got {max_concurrency}")
+
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.weight = max(float(weight), 0.001)
+        self.max_concurrency = max_concurrency
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        # Retries are handled by OpenAIClient, so failures are visible to the pool
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client, max_retries=0)
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = None
+        self.disabled = False
+
+    def close(self):
+        self.http_client.close()
+
+class BackendPool:
+    def __init__(self, backends, failure_threshold=3, ejection_seconds=30.0, max_ejection_seconds=300.0,
+                 metrics=None, clock=time.monotonic):
+        """
+        :param backends: List of Backend.
+        :param failure_threshold: Consecutive failures ejecting a backend.
+        :param ejection_seconds: First ejection time, doubled at every ejection in a row.
+        :param max_ejection_seconds: Upper bound for the ejection time.
+        :param metrics: Optional RunMetrics receiving per-backend calls and ejections.
+        :param clock: Monotonic clock, injectable for deterministic use.
+        """
+        if not backends:
+            raise ValueError("The backend pool needs at least one backend")
+        self.backends = list(backends)
+        self.failure_threshold = failure_threshold
+        self.ejection_seconds = ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        self.metrics = metrics
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+
+    def acquire(self):
+        """
+        Picks a backend for one request, waiting for a backend below its concurrency cap, then
+        for its rate budget if no backend has a free rate slot. Hand it back with `release`.
+        """
+        with self._lock:
+            candidates = self._candidates()
+            while not candidates:
+                self._slot_freed.wait(self._next_readmission())
+                candidates = self._candidates()
+            ordered = sorted(candidates, key=self._load)
+            backend = next((b for b in ordered if b.rate_limiter.try_acquire()), None)
+            wait_for_rate = backend is None
+            if wait_for_rate:
+                backend = ordered[0]
+            backend.in_flight += 1
+        if wait_for_rate:
+            backend.rate_limiter.acquire()
+        if self.metrics is not None:
+            self.metrics.increment(f"backend_{backend.name}_calls")
+        return backend
+
+    def release(self, backend, healthy):
+        """
+        :param healthy: True on success, False on a failure attributable to the backend,
+                        None when the outcome says nothing about it (e.g. an invalid request).
+        """
+        with self._lock:
+            backend.in_flight -= 1
+            self._slot_freed.notify()
+            if healthy:
+                backend.consecutive_failures = 0
+                backend.ejections = 0
+                backend.ejected_until = None
+            elif healthy is False:
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.failure_threshold and not self._is_ejected(backend):
+                    self._eject(backend)
+
+    def disable(self, backend):
+        """
+        Takes a backend out for good (rejected credentials). Returns whether others remain.
+        """
+        with self._lock:
+            backend.disabled = True
+            remaining = any(not b.disabled for b in self.backends)
+        if self.metrics is not None:
+            self.metrics.increment("backends_disabled")
+        return remaining
+
+    def close(self):
+        for backend in self.backends:
+            backend.close()
+
+    def _candidates(self):
+        """
+        Backends a request may go to now; empty when they are all at their concurrency cap.
+        """
+        enabled = [b for b in self.backends if not b.disabled] or self.backends
+        available = [b for b in enabled if not self._is_ejected(b)]
+        if not available:
+            available = [min(enabled, key=lambda b: b.ejected_until)]
+        return [b for b in available if not self._is_full(b)]
+
+    def _next_readmission(self):
+        # Seconds until an ejected backend comes back and may have room, None if none is ejected
+        ejected = [b.ejected_until for b in self.backends if not b.disabled and b.ejected_until is not None]
+        if not ejected:
+            return None
+        return max(0.0, min(ejected) - self._clock())
+
+    def _load(self, backend):
+        return (backend.in_flight + 1) / backend.weight
+
+    def _is_full(self, backend):
+        return backend.max_concurrency is not None and backend.in_flight >= backend.max_concurrency
+
+    def _is_ejected(self, backend):
+        if backend.ejected_until is None:
+            return False
+        if self._clock() < backend.ejected_until:
+            return True
+        # Ejection over: re-admitted on probation, the next failure ejects it again
+        backend.ejected_until = None
+        backend.consecutive_failures = self.failure_threshold - 1
+        return False
+
+    def _eject(self, backend):
+        duration = min(self.max_ejection_seconds, self.ejection_seconds * 2 ** backend.ejections)
+        backend.ejected_until = self._clock() + duration
+        backend.ejections += 1
+        logging.warning(f"Backend {backend.name} ejected for {duration:.0f}s after {backend.consecutive_failures} failures")
+        if self.metrics is not None:
+            self.metrics.increment("backend_ejections")
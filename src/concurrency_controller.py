@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+AdaptiveConcurrencyController: AIMD limit on in-flight API requests.
+
+- Additive increase: every `limit` healthy completions raise the limit by one, up to `max_limit`.
+- Multiplicative decrease: a throttled (429), overloaded (5xx) or timed out request, or a p95 latency
+  drifting above `latency_tolerance` times the best p95 seen so far, multiplies the limit by
+  `decrease_factor`, down to `min_limit`.
+- Only one decrease per congestion episode: requests started before the last decrease
+  cannot trigger another one, so a burst of 429s doesn't collapse the limit to the minimum.
+- With `adaptive=False` it's a plain fixed-size limiter with the same interface.
+
+The controller only reacts to the outcomes it's given, never to wall time, so the same
+sequence of outcomes always produces the same limits.
+"""
+
+import threading
+import time
+from collections import deque
+
+SUCCESS = "success"
+THROTTLED = "throttled"
+ERROR = "error"
+
+class AdaptiveConcurrencyController:
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=64, adaptive=True, decrease_factor=0.5,
+                 latency_window=50, latency_tolerance=2.0, metrics=None, clock=time.monotonic):
+        """
+        :param initial_limit: Starting number of allowed in-flight requests.
+        :param min_limit: Lower bound for the limit.
+        :param max_limit: Upper bound for the limit.
+        :param adaptive: False keeps the limit fixed at initial_limit.
+        :param decrease_factor: Multiplier applied to the limit on congestion.
+        :param latency_window: Number of recent successful latencies used for the p95.
+        :param latency_tolerance: p95 growth (vs. the best p95 seen) considered congestion.
+        :param metrics: Optional RunMetrics receiving limit, in-flight and throughput gauges.
+        :param clock: Monotonic clock, used for throughput only.
+        """
+        self.adaptive = adaptive
+        self.min_limit = min_limit if adaptive else initial_limit
+        self.max_limit = max_limit if adaptive else initial_limit
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.metrics = metrics
+        self._clock = clock
+        self._latencies = deque(maxlen=latency_window)
+        self._best_p95 = None
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._next_ticket = 0
+        self._decrease_ticket = 0
+        self._completed = 0
+        self._started_at = clock()
+
+    def acquire(self):
+        """
+        Blocks until a request may start. Returns a ticket to hand back to `release`.
+        """
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._publish()
+            return ticket
+
+    def release(self, ticket, outcome, latency=None):
+        """
+        :param ticket: Value returned by the matching `acquire`.
+        :param outcome: SUCCESS, THROTTLED or ERROR (errors that say nothing about load).
+        :param latency: Seconds the request took, for successful requests.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if outcome == SUCCESS:
+                self._completed += 1
+            if self.adaptive:
+                self._adapt(ticket, outcome, latency)
+            self._publish()
+            self._condition.notify_all()
+
+    def _adapt(self, ticket, outcome, latency):
+        congested = outcome == THROTTLED
+        if outcome == SUCCESS and latency is not None:
+            self._latencies.append(latency)
+            p95 = self.p95_latency()
+            if len(self._latencies) >= min(10, self._latencies.maxlen):
+                if self._best_p95 is None or p95 < self._best_p95:
+                    self._best_p95 = p95
+                elif p95 > self._best_p95 * self.latency_tolerance:
+                    congested = True
+
+        if congested:
+            if ticket >= self._decrease_ticket:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self._decrease_ticket = self._next_ticket
+                self._latencies.clear()  # Measure the new regime from scratch
+        elif outcome == SUCCESS:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def p95_latency(self):
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def throughput(self):
+        elapsed = self._clock() - self._started_at
+        return self._completed / elapsed if elapsed > 0 else 0.0
+
+    def _publish(self):
+        if self.metrics is None:
+            return
+        self.metrics.set("concurrency_limit", int(self.limit))
+        self.metrics.set("peak_concurrency_limit", max(int(self.limit), self.metrics.get("peak_concurrency_limit")))
+        self.metrics.set("requests_in_flight", self._in_flight)
+        self.metrics.set("throughput_requests_per_second", self.throughput())
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""
+DirectoryWatcher: monitors the input directory tree and yields documents that need processing.
+
+- Uses inotify (through the optional `inotify_simple` package) on Linux, and falls back
+  to periodically polling the tree with `os.stat` everywhere else.
+- Debouncing: a file is only handed out once its size and modification time stopped
+  changing for `debounce_seconds`, so partially written or still-copying files are skipped.
+- Content hashing: a file whose content is identical to the last processed version
+  (e.g. touched, or re-saved without changes) is not processed again. With a
+  DocumentManifest the processed hashes survive restarts, so only documents added or
+  changed while the watcher was down are processed at startup.
+"""
+
+import logging
+import os
+import time
+from file_utils import extension_set, find_documents, hash_file, is_supported_document
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+class DirectoryWatcher:
+    def __init__(self, directory, extensions, debounce_seconds=2.0, poll_interval=5.0,
+                 process_existing=True, use_inotify=True, manifest=None, processed_key=None):
+        """
+        :param directory: Root of the tree to watch.
+        :param extensions: Supported document extensions.
+        :param debounce_seconds: How long a file must stay unchanged before it's processed.
+        :param poll_interval: Seconds between scans when polling (and max wait with inotify).
+        :param process_existing: Whether documents already present at startup are processed.
+        :param use_inotify: Set to False to force the polling backend.
+        :param manifest: Optional DocumentManifest: documents whose current content is marked
+                         as processed under `processed_key` are not handed out again.
+        """
+        self.directory = directory
+        self.extensions = extension_set(extensions)
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval = poll_interval
+        self.process_existing = process_existing
+        self.use_inotify = use_inotify and INotify is not None
+        self.manifest = manifest
+        self.processed_key = processed_key
+
+        self._pending = {}    # path -> (last change time, (size, mtime) at that time)
+        self._hashes = {}     # path -> content hash of the last version handed out
+        self._snapshot = {}   # polling backend: path -> (size, mtime)
+        self._inotify = None
+        self._watch_dirs = {} # inotify backend: watch descriptor -> directory
+
+    def watch(self, stop_event=None):
+        """
+        Yields paths of new or modified documents once their content has settled.
+        Runs until `stop_event` (a threading.Event) is set.
+        """
+        self._start()
+        try:
+            while stop_event is None or not stop_event.is_set():
+                for path in self._wait_for_changes(self._next_timeout()):
+                    self._pending[path] = (time.monotonic(), self._signature(path))
+                yield from self._settled_documents()
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+
+    def _start(self):
+        existing = find_documents(self.directory, self.extensions)
+        if self.use_inotify:
+            self._inotify = INotify()
+            self._add_watches(self.directory)
+            logging.info(f"Watching {self.directory} with inotify")
+        else:
+            self._snapshot = {path: self._signature(path) for path in existing}
+            logging.info(f"Watching {self.directory} by polling every {self.poll_interval}s")
+
+        if self.process_existing:
+            for path in existing:
+                self._pending[path] = (float("-inf"), self._signature(path))
+        else:
+            for path in existing:
+                self._hashes[path] = self._content_hash(path)
+
+    def _next_timeout(self):
+        # Wake up in time to release files whose debounce window is about to expire
+        if self._pending:
+            return min(self.poll_interval, self.debounce_seconds)
+        return self.poll_interval
+
+    def _settled_documents(self):
+        now = time.monotonic()
+        for path, (changed_at, signature) in list(self._pending.items()):
+            if now - changed_at < self.debounce_seconds:
+                continue
+            current = self._signature(path)
+            if current is None:
+                del self._pending[path]  # Removed or renamed before settling
+                continue
+            if current != signature:
+                self._pending[path] = (now, current)  # Still being written
+                continue
+
+            del self._pending[path]
+            content_hash = self._content_hash(path)
+            if content_hash is None or self._already_processed(path, content_hash):
+                continue
+            self._hashes[path] = content_hash
+            yield path
+
+    def _wait_for_changes(self, timeout):
+        if self._inotify is not None:
+            return self._read_inotify_events(timeout)
+        time.sleep(timeout)
+        return self._poll_changes()
+
+    def _poll_changes(self):
+        changed = []
+        current = {}
+        for path in find_documents(self.directory, self.extensions):
+            signature = self._signature(path)
+            current[path] = signature
+            if self._snapshot.get(path) != signature:
+                changed.append(path)
+        self._snapshot = current
+        return changed
+
+    def _add_watches(self, directory):
+        mask = (flags.CREATE | flags.CLOSE_WRITE | flags.MODIFY | flags.MOVED_TO
+                | flags.DELETE_SELF)
+        for root, dirs, _ in os.walk(directory):
+            try:
+                wd = self._inotify.add_watch(root, mask)
+            except OSError as e:
+                logging.warning(f"Cannot watch {root}: {e}")
+                continue
+            self._watch_dirs[wd] = root
+
+    def _read_inotify_events(self, timeout):
+        changed = []
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            root = self._watch_dirs.get(event.wd)
+            if root is None:
+                continue
+            if event.mask & flags.DELETE_SELF:
+                del self._watch_dirs[event.wd]
+                continue
+            path = os.path.join(root, event.name)
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO):
+                    # New folder: watch it and pick up whatever was copied in along with it
+                    self._add_watches(path)
+                    changed.extend(find_documents(path, self.extensions))
+            elif is_supported_document(event.name, self.extensions):
+                changed.append(path)
+        return changed
+
+    def _signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _content_hash(self, path):
+        if self.manifest is not None:
+            return self.manifest.refresh(path)
+        try:
+            return hash_file(path)
+        except OSError:
+            return None
+
+    def _already_processed(self, path, content_hash):
+        if self._hashes.get(path) == content_hash:
+            return True
+        return self.manifest is not None and not self.manifest.needs_processing(path, self.processed_key)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+"""
+Distributed runs: a coordinator and any number of workers sharing a WorkQueue.
+
+    python src/main.py --coordinator --queue /shared/queue.sqlite   # parse, enqueue, archive
+    python src/main.py --worker --queue /shared/queue.sqlite        # on every host, as many as needed
+
+- Coordinator: parses the documents, enqueues one task per section (sections needing no API
+  call are resolved right away), then acts as finaliser: every document whose tasks are all
+  finished is handed to DocumentArchiver, exactly as a local run would.
+- QueueWorker: claims batches of tasks, processes them concurrently within its client's
+  concurrency budget, heartbeats the leases of the tasks it's working on, and stores the
+  results as they arrive. Workers build processors from the run settings stored in the queue,
+  while the API settings (keys, backends, rate budgets) come from each worker's own config.
+
+Tasks of a crashed worker are re-queued when their lease expires. A worker with
+`exit_when_idle` stops once the runs that were active when it started (or, if none was, the
+next ones) are done, so it can be started before its coordinator.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pipeline import load_processor_class
+from processors.base_openai_processor import BaseOpenAIProcessor
+
+class Coordinator:
+    def __init__(self, queue, parser, processor, archiver, docx_in_docx_mode, poll_interval=1.0):
+        """
+        :param queue: WorkQueue shared with the workers.
+        :param processor: Processor of the run: decides which sections need no API call, and names
+                          the outputs. Its client is never used.
+        """
+        if not self.supports(processor):
+            raise ValueError(f"{processor.__class__.__name__} can't run distributed: only OpenAI processors can")
+        self.queue = queue
+        self.parser = parser
+        self.processor = processor
+        self.archiver = archiver
+        self.docx_in_docx_mode = docx_in_docx_mode
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def supports(processor):
+        return isinstance(processor, BaseOpenAIProcessor)
+
+    def enqueue(self, documents, processor_name, processor_parameters):
+        """
+        Creates a run and enqueues the sections of every document. Returns the run id.
+        """
+        run_id = self.queue.create_run({"processor": processor_name, "processor_parameters": processor_parameters})
+        try:
+            for doc_path in documents:
+                print(f"Enqueuing {doc_path}")
+                sections = self.parser.parse_document(doc_path, docx_in_docx_mode=self.docx_in_docx_mode)
+                self.queue.add_document(run_id, doc_path, sections, resolve=self._resolve)
+        finally:
+            # Even a partially enqueued run must let its workers finish
+            self.queue.close_run(run_id)
+        return run_id
+
+    def _resolve(self, section):
+        if self.processor.do_not_process(section):
+            return section["content"]
+        return None
+
+    def finalise(self, run_id):
+        """
+        Archives the finished documents of a run until all of them are. Returns the number archived.
+        """
+        archived = 0
+        while True:
+            drained = self.queue.run_finished(run_id)
+            for document_id, _, doc_path in self.queue.finished_documents(run_id):
+                sections, results = self.queue.document_results(document_id)
+                if len(results) < len(sections):
+                    logging.error(f"{len(sections) - len(results)} sections of {doc_path} failed")
+                try:
+                    self.archiver.archive_document(doc_path, sections, results, self.processor)
+                    print(f"Archived {doc_path}")
+                except Exception as e:
+                    logging.error(f"Failed to archive {doc_path}: {e}")
+                self.queue.mark_archived(document_id)
+                archived += 1
+            if drained:
+                return archived
+            time.sleep(self.poll_interval)
+
+class QueueWorker:
+    def __init__(self, queue, client, worker_id=None, batch_size=None, poll_interval=1.0, exit_when_idle=True):
+        """
+        :param queue: WorkQueue shared with the coordinator and the other workers.
+        :param client: OpenAIClient used for every task of every run.
+        :param worker_id: Lease owner name, defaults to host, pid and a random suffix.
+        :param batch_size: Tasks claimed at once, defaults to twice the client's concurrency.
+        :param poll_interval: Wait between claims when the queue has nothing to offer.
+        :param exit_when_idle: Stop once every run is closed and no task is left.
+        """
+        self.queue = queue
+        self.client = client
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.workers = max(1, getattr(client, "max_concurrency", 1))
+        self.batch_size = batch_size or 2 * self.workers
+        self.poll_interval = poll_interval
+        self.exit_when_idle = exit_when_idle
+        self.metrics = getattr(client, "metrics", None)
+        self._processors = {}
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._stop = threading.Event()
+        # Runs older than this were over before the worker started: they don't count as its work
+        self._first_run = queue.first_active_run()
+
+    def run(self):
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                self._work(executor)
+        finally:
+            self._stop.set()
+            heartbeat.join()
+            self.queue.close()
+
+    def stop(self):
+        self._stop.set()
+
+    def _work(self, executor):
+        running = {}
+        while not self._stop.is_set():
+            # Keep the executor fed: claim a new batch as soon as there's room for it
+            free = self.batch_size - len(running)
+            if free > 0:
+                for task in self.queue.claim(self.worker_id, free):
+                    self._count("tasks_claimed")
+                    if task["requeued"]:
+                        self._count("tasks_requeued_after_expired_lease")
+                    with self._active_lock:
+                        self._active.add(task["id"])
+                    running[executor.submit(self._process, task)] = (task["id"], task["run_id"])
+
+            if not running:
+                if self.exit_when_idle and self.queue.is_drained(since_run=self._first_run):
+                    return
+                self._stop.wait(self.poll_interval)
+                continue
+
+            done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+            results = []
+            finished_runs = set()
+            for future in done:
+                task_id, run_id = running.pop(future)
+                finished_runs.add(run_id)
+                try:
+                    results.append((task_id, future.result()))
+                except Exception as e:
+                    logging.error(f"Task {task_id} failed: {e}")
+                    results.append((task_id, None))
+            if results:
+                accepted = self.queue.complete(self.worker_id, results)
+                self._count("tasks_completed", accepted)
+                if accepted < len(results):
+                    self._count("task_results_discarded", len(results) - accepted)
+                with self._active_lock:
+                    self._active.difference_update(task_id for task_id, _ in results)
+                self._release_processors(finished_runs - {run_id for _, run_id in running.values()})
+
+    def _process(self, task):
+        processor = self._processor(task["run_id"])
+        section = {"id": task["section_id"], "title": task["title"], "content": task["content"]}
+        # The whole result: model, tokens and latency go to the results store with the content
+        return processor.process_section(section, task["section_id"])
+
+    def _processor(self, run_id):
+        processor = self._processors.get(run_id)
+        if processor is None:
+            settings = self.queue.run_settings(run_id)
+            ProcessorClass = load_processor_class(settings["processor"])
+            processor = ProcessorClass(self.client, settings["processor_parameters"])
+            self._processors[run_id] = processor
+        return processor
+
+    def _release_processors(self, run_ids):
+        # A worker outlives many runs: drop the processor of a run once nothing of it is left
+        for run_id in run_ids:
+            if run_id in self._processors and self.queue.run_finished(run_id):
+                del self._processors[run_id]
+
+    def _heartbeat(self):
+        # Leases are renewed well before they expire, so a slow section doesn't lose its lease
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            with self._active_lock:
+                task_ids = list(self._active)
+            try:
+                self.queue.heartbeat(self.worker_id, task_ids)
+            except Exception as e:
+                logging.error(f"Heartbeat failed: {e}")
+
+    def _count(self, name, amount=1):
+        if self.metrics is not None:
+            self.metrics.increment(name, amount)
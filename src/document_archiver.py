@@ -6,14 +6,28 @@ DocumentArchiver
 A class for processing and archiving documents into specified formats (TXT or DOCX).
 It provides support for adding section titles, preserving original formatting, and 
 advanced DOCX generation for DOCX inputs.
+Results can also be recorded in a ResultsStore, and exported from it later.
 """
 
+import logging
 import os
+from collections.abc import Mapping
 from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
 from docx.enum.text import WD_BREAK
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+
+# Run children carrying text, as read by python-docx's run.text (line breaks are w:br
+# of type textWrapping; page and column breaks are kept)
+_TEXT_TAGS = frozenset(qn(tag) for tag in ("w:t", "w:tab", "w:cr", "w:noBreakHyphen", "w:ptab"))
+_BR_TAG = qn("w:br")
+_BR_TYPE_ATTR = qn("w:type")
 
 class DocumentArchiver:
-    def __init__(self, output_dir, output_format, add_section_title=False, docx_in_docx_mode=False):
+    def __init__(self, output_dir, output_format, add_section_title=False, docx_in_docx_mode=False,
+                 results_store=None):
         """
         Initializes the DocumentArchiver.
 
@@ -21,13 +35,26 @@ class DocumentArchiver:
         :param output_format: Format of the output files ("txt" or "docx").
         :param add_section_title: Whether to add section titles in the output.
         :param docx_in_docx_mode: Whether to use advanced DOCX generation mode.
+        :param results_store: Optional ResultsStore, also receiving every archived result.
         """
         self.output_dir = output_dir
         self.output_format = output_format
         self.add_section_title = add_section_title
         self.docx_in_docx_mode = docx_in_docx_mode
+        self.results_store = results_store
+
+    def result_recorder(self, doc_path, processor):
+        """
+        A ResultsRecorder storing the results of the document as they arrive (to hand back to
+        archive_document), or None without a results store.
+        """
+        if self.results_store is None:
+            return None
+        return self.results_store.recorder(
+            doc_path, processor.__class__.__name__, processor.output_suffix(), self._paragraph_level(doc_path)
+        )
 
-    def archive_document(self, doc_path, sections, results, processor):
+    def archive_document(self, doc_path, sections, results, processor, recorder=None):
         """
         Archives the processed document in the specified format.
 
@@ -35,14 +62,50 @@ class DocumentArchiver:
         :param sections: Parsed sections of the document.
         :param results: Processed results for each section.
         :param processor: The processor instance used for handling sections.
+        :param recorder: ResultsRecorder that already received the results, if any.
+        """
+        if recorder is not None:
+            recorder.finish()
+        elif self.results_store is not None:
+            self.results_store.record_document(
+                doc_path, processor.__class__.__name__, processor.output_suffix(), sections, results,
+                self._paragraph_level(doc_path),
+            )
+        self.write_outputs(doc_path, sections, results, processor.output_suffix())
+
+    def _paragraph_level(self, doc_path):
+        # The parser only splits .docx inputs by paragraph, and only in docx-in-docx mode
+        return self.docx_in_docx_mode and os.path.splitext(doc_path)[1].lower() == ".docx"
+
+    def export_results(self, results_store, processor=None):
+        """
+        Writes txt/docx outputs from the results stored in a ResultsStore, without processing
+        anything again. Returns the number of documents exported.
+
+        :param processor: Optional processor class name, only its results are exported.
+        """
+        exported = 0
+        for doc_path, processor_name, output_suffix, paragraph_level in results_store.documents(processor):
+            results = results_store.results(doc_path, processor_name, output_suffix)
+            # Stored ids are the section ids, so the results also stand for the sections. Only
+            # paragraph-level results can be written back into the paragraphs of the original
+            self.write_outputs(doc_path, results, results, output_suffix, docx_in_docx_mode=paragraph_level)
+            exported += 1
+        return exported
+
+    def write_outputs(self, doc_path, sections, results, output_suffix, docx_in_docx_mode=None):
+        """
+        :param docx_in_docx_mode: Overrides the archiver's mode for this document.
         """
         base_name = os.path.splitext(os.path.basename(doc_path))[0]
-        full_name = f"{base_name}_{processor.output_suffix()}"
+        full_name = f"{base_name}_{output_suffix}"
 
         if self.output_format == "txt":
             self._save_as_txt(full_name, results)
         elif self.output_format == "docx":
-            self._save_as_docx(doc_path, sections, results, full_name)
+            if docx_in_docx_mode is None:
+                docx_in_docx_mode = self.docx_in_docx_mode
+            self._save_as_docx(doc_path, sections, results, full_name, docx_in_docx_mode)
         else:
             raise ValueError(f"Unrecognised output format: {self.output_format}")
 
@@ -53,12 +116,14 @@ class DocumentArchiver:
                 for i, result in enumerate(results):
                     if self.add_section_title:
                         f.write(f"Section {i + 1}:\n")
-                    f.write(result + "\n" + "=" * 40 + "\n")
+                    # Processors return {"id", "content", ...} dicts, the Reporter plain strings
+                    content = result["content"] if isinstance(result, Mapping) else result
+                    f.write(content + "\n" + "=" * 40 + "\n")
 
-    def _save_as_docx(self, doc_path, sections, results, full_name):
+    def _save_as_docx(self, doc_path, sections, results, full_name, docx_in_docx_mode):
         out_file = os.path.join(self.output_dir, f"{full_name}.docx")
         in_extension = os.path.splitext(os.path.basename(doc_path))[1]
-        if self.docx_in_docx_mode and in_extension == ".docx":
+        if docx_in_docx_mode and in_extension == ".docx":
             self._generate_docx_from_docx(doc_path, sections, results, out_file)
         else:
             self._generate_docx_from_other_format(results, out_file)
@@ -67,74 +132,123 @@ class DocumentArchiver:
         doc = Document()
     
         for section in results:
-            content = section["content"]
+            content = section["content"] if isinstance(section, Mapping) else section
             paragraphs = [p.strip() for p in content.split("\n\n") if p.strip()]
-        
-        for paragraph in paragraphs:
-            doc.add_paragraph(paragraph)
+
+            for paragraph in paragraphs:
+                doc.add_paragraph(paragraph)
     
         doc.save(output_path)
 
-    # Output docx from docx: process a previously mapped set of dictionaries, allowing
-    # paragraph-by-paragraph matching between original text and processed one    
+    # Output docx from docx: process a previously mapped set of sections, allowing
+    # paragraph-by-paragraph matching between original text and processed one.
+    # Single pass over the document: styles are resolved once, and run text is rewritten
+    # directly in the XML, so big books don't go through the python-docx object model
+    # paragraph by paragraph.
     def _generate_docx_from_docx(self, original_path, sections, results, output_path):
-        doc = Document(original_path)
-        results_by_id = {r["id"]: r for r in results}  # Create a mapping of results by ID
-
         if len(sections) != len(results):
             raise ValueError("Sections and results lengths do not match.")
 
-        def process_paragraph(paragraph, content, style_name):
-            # Save original font settings
-            original_font_name = None
-            original_font_size = None
-            if paragraph.runs:
-                original_font_name = paragraph.runs[0].font.name
-                original_font_size = paragraph.runs[0].font.size
-
-            # Preserve non-text elements by clearing only text in existing runs
-            if content.strip():
-                if len(paragraph.runs) > 0:
-                    paragraph.runs[0].text = content  # Modify the first run only
-                    for run in paragraph.runs[1:]:
-                        run.text = ''  # Clear all other runs
-                else:
-                    paragraph.add_run(content)  # Add content if no runs exist
-
-            # Restore original font settings
-            if paragraph.runs:
-                run = paragraph.runs[0]
-                if original_font_name:
-                    run.font.name = original_font_name
-                if original_font_size:
-                    run.font.size = original_font_size
-
-            # Apply styles if specified
-            if style_name and style_name in [s.name for s in paragraph.part.styles]:
-                paragraph.style = style_name
-
-        # Track matched paragraphs by their IDs to prevent overwriting
-        matched_ids = set()
-
-        # Process main document paragraphs
-        for idx, paragraph in enumerate(doc.paragraphs):
-            section_id = f"main-{idx}"
-            rendered_info = results_by_id.get(section_id)
-            if rendered_info and section_id not in matched_ids:
-                process_paragraph(paragraph, rendered_info.get("content", "").strip(), rendered_info.get("style_name", "").strip())
-                matched_ids.add(section_id)
-
-        # Process headers and footers
+        doc = Document(original_path)
+        # Section ids are paragraph positions: results are laid out in two flat lists, long enough
+        # for the last id (exported results may lack some paragraphs, e.g. failed calls)
+        size = max([len(sections)] + [result["id"] + 1 for result in results])
+        contents = [None] * size
+        style_names = [None] * size
+        missing = size - len({result["id"] for result in results})
+        if missing:
+            logging.warning(f"{missing} paragraphs of {original_path} have no result, kept as in the original")
+        for result in results:
+            contents[result["id"]] = result.get("content")
+            style_names[result["id"]] = result.get("style_name")
+        style_ids = self._paragraph_style_ids(doc)
+
+        for section_id, p in enumerate(self._iter_paragraph_elements(doc)):
+            if section_id < len(contents) and (contents[section_id] is not None or style_names[section_id]):
+                self._rewrite_paragraph(
+                    p,
+                    (contents[section_id] or "").strip(),
+                    (style_names[section_id] or "").strip(),
+                    style_ids,
+                )
+
+        doc.save(output_path)
+
+    def _iter_paragraph_elements(self, doc):
+        """
+        Yields the w:p elements of the main document paragraphs, then of headers and footers,
+        in the order DocumentParser._parse_docx_by_paragraph numbers its sections.
+        """
+        yield from doc.element.body.iterchildren(qn("w:p"))
         for section in doc.sections:
-            def process_section(paragraphs, section_type):
-                for idx, paragraph in enumerate(paragraphs):
-                    section_id = f"{section_type}-{idx}"
-                    rendered_info = results_by_id.get(section_id)
-                    if rendered_info and section_id not in matched_ids:
-                        process_paragraph(paragraph, rendered_info.get("content", "").strip(), rendered_info.get("style_name", "").strip())
-                        matched_ids.add(section_id)
-
-            process_section(section.header.paragraphs, "header")
-            process_section(section.footer.paragraphs, "footer")
-
-        doc.save(output_path)
\ No newline at end of file
+            for part in (section.header, section.footer):
+                for paragraph in part.paragraphs:
+                    yield paragraph._p
+
+    def _paragraph_style_ids(self, doc):
+        """
+        Maps paragraph style names to style ids, with None for the default style
+        (which is expressed by having no w:pStyle at all).
+        """
+        default_style = doc.styles.default(WD_STYLE_TYPE.PARAGRAPH)
+        default_id = default_style.style_id if default_style is not None else None
+        return {
+            s.name: (None if s.style_id == default_id else s.style_id)
+            for s in doc.styles
+            if s.type == WD_STYLE_TYPE.PARAGRAPH
+        }
+
+    def _rewrite_paragraph(self, p, content, style_name, style_ids):
+        # Preserve non-text elements (drawings, page breaks, fields) and run formatting:
+        # only the text of the runs is replaced, the first run receives the new content
+        if content:
+            runs = p.findall(qn("w:r"))
+            if runs:
+                self._replace_run_text(runs[0], content)
+                for run in runs[1:]:
+                    self._remove_run_text(run)
+            else:
+                Paragraph(p, None).add_run(content)  # Add content if no runs exist
+
+        # Apply styles if specified
+        if style_name and style_name in style_ids:
+            style_id = style_ids[style_name]
+            if p.style != style_id:
+                p.style = style_id
+
+    def _remove_run_text(self, r):
+        """
+        Removes the text-bearing children of a run, returns the index of the first one removed.
+        """
+        first_index = None
+        for child in list(r):
+            if child.tag in _TEXT_TAGS or (child.tag == _BR_TAG and child.get(_BR_TYPE_ATTR, "textWrapping") == "textWrapping"):
+                if first_index is None:
+                    first_index = r.index(child)
+                r.remove(child)
+        return first_index
+
+    def _replace_run_text(self, r, content):
+        index = self._remove_run_text(r)
+        if index is None:
+            index = len(r)
+        for element in self._text_elements(content):
+            r.insert(index, element)
+            index += 1
+
+    def _text_elements(self, content):
+        """
+        Translates text into w:t / w:tab / w:br elements, the same way python-docx's run.text does.
+        """
+        for i, line in enumerate(content.replace("\r\n", "\n").replace("\r", "\n").split("\n")):
+            if i:
+                yield OxmlElement("w:br")
+            for j, chunk in enumerate(line.split("\t")):
+                if j:
+                    yield OxmlElement("w:tab")
+                if chunk:
+                    t = OxmlElement("w:t")
+                    t.text = chunk
+                    if chunk != chunk.strip():
+                        t.set(qn("xml:space"), "preserve")
+                    yield t
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""
+Cached, incremental document discovery for large input trees.
+
+- `DocumentManifest` persists, between runs, the listing and mtime of every directory and
+  the (size, mtime, content hash) of every document, plus which content hash each
+  processor already handled.
+- `iter_documents` walks the tree with `os.scandir`, reuses the cached listing of every
+  directory whose mtime did not change, hashes only files whose size or mtime changed,
+  and lazily yields the documents that still need work, so processing can start before
+  the walk is over.
+
+Editing a file in place does not change its directory's mtime, so files in unchanged
+directories are still stat'ed once. On shares where documents only ever appear or get
+replaced (which does touch the directory), `trust_directory_mtime` skips even that.
+"""
+
+import json
+import logging
+import os
+from file_utils import extension_set, hash_file, list_directory
+
+MANIFEST_VERSION = 1
+
+class DocumentManifest:
+    def __init__(self, path):
+        """
+        :param path: JSON file the manifest is loaded from and saved to.
+        """
+        self.path = path
+        self.directories = {}  # dir path -> {"mtime": ns, "files": [...], "dirs": [...]}
+        self.files = {}        # doc path -> {"size": int, "mtime": ns, "hash": str, "processed": {key: hash}}
+        self.extensions = None # sorted extensions the directory listings were filtered with
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+            return
+        if data.get("version") != MANIFEST_VERSION:
+            return
+        self.directories = data.get("directories", {})
+        self.files = data.get("files", {})
+        self.extensions = data.get("extensions")
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION, "extensions": self.extensions,
+                       "directories": self.directories, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+
+    def needs_processing(self, doc_path, processed_key):
+        record = self.files.get(doc_path)
+        return record is None or record.get("processed", {}).get(processed_key) != record["hash"]
+
+    def refresh(self, doc_path):
+        """
+        Updates the record of a document (hashing it only if size or mtime changed) and
+        returns its content hash, or None if the file vanished.
+        """
+        if not _refresh_file(self, doc_path):
+            return None
+        return self.files[doc_path]["hash"]
+
+    def mark_processed(self, doc_path, processed_key):
+        record = self.files.get(doc_path)
+        if record is not None:
+            record.setdefault("processed", {})[processed_key] = record["hash"]
+
+    def forget_missing(self, seen_directories, seen_files):
+        self.directories = {d: v for d, v in self.directories.items() if d in seen_directories}
+        self.files = {f: v for f, v in self.files.items() if f in seen_files}
+
+def iter_documents(directory, extensions, manifest=None, processed_key=None, trust_directory_mtime=False):
+    """
+    Lazily yields supported documents under `directory`, top-down like os.walk.
+
+    :param manifest: Optional DocumentManifest. Without it, every document is yielded.
+    :param processed_key: With a manifest, only documents whose current content was not yet
+                          marked as processed under this key are yielded.
+    :param trust_directory_mtime: Don't stat files in directories whose mtime did not change.
+    """
+    ext_set = extension_set(extensions)
+    if manifest is not None and manifest.extensions != sorted(ext_set):
+        # Cached listings only hold the files matching the extensions they were made with
+        manifest.directories = {}
+        manifest.extensions = sorted(ext_set)
+    seen_directories, seen_files = set(), set()
+    stack = [directory]
+
+    while stack:
+        current = stack.pop()
+        files, subdirs, unchanged = _list_cached(current, ext_set, manifest)
+        seen_directories.add(current)
+        stack.extend(reversed(subdirs))
+
+        for doc_path in files:
+            if manifest is None:
+                yield doc_path
+                continue
+            if not (unchanged and trust_directory_mtime and doc_path in manifest.files):
+                if not _refresh_file(manifest, doc_path):
+                    continue
+            seen_files.add(doc_path)
+            if processed_key is None or manifest.needs_processing(doc_path, processed_key):
+                yield doc_path
+
+    # Only reached when the whole tree was walked: drop what disappeared since last run
+    if manifest is not None:
+        manifest.forget_missing(seen_directories, seen_files)
+
+def _list_cached(directory, ext_set, manifest):
+    """
+    Returns (files, subdirs, unchanged) for a directory, reusing the manifest listing
+    when the directory's mtime did not change.
+    """
+    if manifest is None:
+        files, subdirs = list_directory(directory, ext_set)
+        return files, subdirs, False
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return [], [], False
+
+    cached = manifest.directories.get(directory)
+    if cached is not None and cached["mtime"] == mtime:
+        join = os.path.join
+        return ([join(directory, n) for n in cached["files"]],
+                [join(directory, n) for n in cached["dirs"]], True)
+
+    files, subdirs = list_directory(directory, ext_set)
+    manifest.directories[directory] = {
+        "mtime": mtime,
+        "files": [os.path.basename(f) for f in files],
+        "dirs": [os.path.basename(d) for d in subdirs],
+    }
+    return files, subdirs, False
+
+def _refresh_file(manifest, doc_path):
+    """
+    Updates the manifest record of a document, hashing it only if size or mtime changed.
+    Returns False if the file vanished.
+    """
+    try:
+        stat = os.stat(doc_path)
+        record = manifest.files.get(doc_path)
+        if record is not None and record["size"] == stat.st_size and record["mtime"] == stat.st_mtime_ns:
+            return True
+        content_hash = hash_file(doc_path)
+    except OSError:
+        return False
+
+    processed = record.get("processed", {}) if record is not None else {}
+    manifest.files[doc_path] = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "hash": content_hash,
+        "processed": processed,
+    }
+    return True
@@ -7,24 +7,71 @@ Parses documents into structured sections based on headings and content.
 - Merges sections with low word count below a configurable threshold (for DOCX).
 - Customizable heading styles determine section boundaries (for DOCX).
 - PDF documents are split by page, each becoming its own section.
+- Text and markdown files are streamed from a memory map into token-bounded chunks,
+  split at paragraph (and markdown heading) boundaries, or at line feeds in paragraphs too
+  long for one chunk; only a bounded window of the file is decoded at a time.
 - Can return sections with or without title, depending on the param in main
+- In docx-in-docx mode, paragraphs are returned as a compact SectionStore.
 """
 
+import mmap
 import os
+import re
+from functools import lru_cache
 from docx import Document
 from PyPDF2 import PdfReader
 import tiktoken
+from section_store import SectionKind, SectionStore
+
+# Cut points of _smart_split, coarsest first: after sentences (a point followed by whitespace,
+# so numbers like 3.14 stay whole), lines, words
+_SPLIT_BOUNDARIES = (r'(?<=\.)(?=\s)', r'(?<=\n)', r'(?<=\s)')
+
+@lru_cache(maxsize=None)
+def get_encoding(model="gpt-4o"):
+    """
+    Loads the tokenizer once per process, so long-running workers keep it warm.
+    """
+    return tiktoken.encoding_for_model(model)
 
 class DocumentParser:
-    def __init__(self, heading_styles, min_word_threshold=2):
+    # Bump whenever a change in parsing logic alters the produced sections (invalidates the cache)
+    PARSER_VERSION = 6
+
+    def __init__(self, heading_styles, min_word_threshold=2, cache=None):
         """
         :param heading_styles: A set or list of style names considered headings in DOCX.
         :param min_word_threshold: Sections below this word count will be merged with the next.
+        :param cache: Optional SectionCache, reusing parsed sections across runs.
         """
         self.heading_styles = heading_styles
         self.min_word_threshold = min_word_threshold
+        self.cache = cache
 
     def parse_document(self, file_path, docx_in_docx_mode=False):
+        if self.cache is None:
+            return self._parse_document(file_path, docx_in_docx_mode)
+
+        key = self.cache.key(file_path, self.cache_settings(docx_in_docx_mode))
+        sections = self.cache.get(key)
+        if sections is None:
+            sections = self._parse_document(file_path, docx_in_docx_mode)
+            self.cache.put(key, sections)
+        return sections
+
+    def cache_settings(self, docx_in_docx_mode):
+        """
+        Everything, besides the file content, that determines the parsed sections.
+        """
+        return {
+            "parser_version": self.PARSER_VERSION,
+            "heading_styles": sorted(self.heading_styles or []),
+            "min_word_threshold": self.min_word_threshold,
+            "max_tokens": self._calculate_max_tokens(),
+            "docx_in_docx_mode": bool(docx_in_docx_mode),
+        }
+
+    def _parse_document(self, file_path, docx_in_docx_mode):
         ext = os.path.splitext(file_path)[1].lower()
         if ext == ".docx":
             if docx_in_docx_mode:
@@ -36,17 +83,146 @@ class DocumentParser:
         else:
             return self._parse_text(file_path)
 
+    def iter_sections(self, file_path, docx_in_docx_mode=False):
+        """
+        Like parse_document, but text and markdown files are yielded chunk by chunk while the
+        file is read, so the first section reaches the processor right away and memory does
+        not depend on file size.
+        """
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext in (".docx", ".pdf"):
+            return self.parse_document(file_path, docx_in_docx_mode=docx_in_docx_mode)
+        return self._iter_text_chunks(file_path)
+
     def _parse_text(self, file_path):
         """
-        Parses a plain text file as a single section.
+        Parses a plain text file as a single section, split into chunks if it's too long.
         """
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read().strip()
-        if not text:
-            return []
-        sections = [{"title": "Document", "content": text}]
-        return self._split_sections_if_needed(sections)
-    
+        return list(self._iter_text_chunks(file_path))
+
+    def _iter_text_chunks(self, file_path):
+        """
+        Streams a text/markdown file through a memory map and yields sections of at most
+        max tokens, cut at paragraph boundaries. In markdown files a heading is preferred as
+        cut point, and the section title follows the current heading.
+        """
+        is_markdown = os.path.splitext(file_path)[1].lower() == ".md"
+        max_tokens = self._calculate_max_tokens()
+
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                title = "Document"
+                chunk = []  # Blocks of the current chunk: (start, end, tokens, heading or None)
+                chunk_tokens = 0
+
+                # A token is at most a few bytes: blocks are cut well before they could hold many sections
+                blocks = self._iter_text_blocks(data, is_markdown, max_block_bytes=4 * max_tokens)
+                for start, end, heading in blocks:
+                    text = data[start:end].decode('utf-8')
+                    tokens = self._calculate_tokens(text)
+
+                    while chunk and chunk_tokens + tokens > max_tokens:
+                        # Cut at the last heading of the chunk if there's one, else right here
+                        cut = max((i for i, b in enumerate(chunk) if b[3] is not None and i > 0), default=len(chunk))
+                        section = self._text_section(data, chunk[:cut], title)
+                        if section:
+                            yield section
+                        title = self._last_heading(chunk[:cut], title)
+                        chunk = chunk[cut:]
+                        chunk_tokens = sum(b[2] for b in chunk)
+
+                    if tokens > max_tokens:
+                        # A single paragraph above the limit: flush and split it by sentences
+                        section = self._text_section(data, chunk, title)
+                        if section:
+                            yield section
+                        title = self._last_heading(chunk, title)
+                        chunk, chunk_tokens = [], 0
+                        yield from self._smart_split({"title": heading or title, "content": text.strip()})
+                        title = heading or title
+                        continue
+
+                    chunk.append((start, end, tokens, heading))
+                    chunk_tokens += tokens
+
+                section = self._text_section(data, chunk, title)
+                if section:
+                    yield section
+
+    def _iter_text_blocks(self, data, is_markdown, max_block_bytes):
+        """
+        Yields (start, end, heading) byte ranges of paragraphs: runs of lines separated by blank
+        lines. In markdown, a heading line always opens a new block and `heading` is its text.
+        Blocks never exceed `max_block_bytes`: longer paragraphs are cut at line feeds, and lines
+        longer than that at a space (or, without one, between two UTF-8 characters).
+        Cutting at line feeds is always safe for UTF-8.
+        """
+        size = len(data)
+        block_start = None
+        block_heading = None
+        pos = 0
+        at_line_start = True
+        while pos < size:
+            line_end = data.find(b"\n", pos, pos + max_block_bytes)
+            if line_end != -1:
+                line_end += 1
+            elif pos + max_block_bytes >= size:
+                line_end = size
+            else:
+                line_end = self._window_end(data, pos, pos + max_block_bytes)
+            line = data[pos:line_end].strip()
+
+            if block_start is not None and line and line_end - block_start > max_block_bytes:
+                yield block_start, pos, block_heading
+                block_start, block_heading = None, None
+
+            if not line:
+                if block_start is not None:
+                    yield block_start, pos, block_heading
+                    block_start, block_heading = None, None
+            elif is_markdown and at_line_start and line.startswith(b"#"):
+                if block_start is not None:
+                    yield block_start, pos, block_heading
+                block_start = pos
+                block_heading = line.lstrip(b"#").strip().decode('utf-8') or None
+            elif block_start is None:
+                block_start = pos
+            at_line_start = data[line_end - 1:line_end] == b"\n"
+            pos = line_end
+
+        if block_start is not None:
+            yield block_start, size, block_heading
+
+    def _window_end(self, data, start, limit):
+        """
+        Cut point of a line longer than the window [start, limit): after its last space, else
+        at the last UTF-8 character boundary.
+        """
+        space = data.rfind(b" ", start, limit)
+        if space != -1:
+            return space + 1
+        end = limit
+        # Continuation bytes (10xxxxxx) never start a character
+        while end > start + 1 and data[end] & 0xC0 == 0x80:
+            end -= 1
+        return end
+
+    def _text_section(self, data, blocks, title):
+        if not blocks:
+            return None
+        content = data[blocks[0][0]:blocks[-1][1]].decode('utf-8').strip()
+        if not content:
+            return None
+        return {"title": blocks[0][3] or title, "content": content}
+
+    def _last_heading(self, blocks, title):
+        for block in reversed(blocks):
+            if block[3] is not None:
+                return block[3]
+        return title
+
     def _parse_docx(self, file_path):
         """
         Parses a DOCX file by headings, ensuring titles merge with the following paragraphs
@@ -103,31 +279,35 @@ class DocumentParser:
         return self._split_sections_if_needed(merged_sections)
 
     def _parse_docx_by_paragraph(self, file_path):
+        """
+        One section per paragraph of the main document, then of every header and footer, kept
+        in a compact SectionStore: ids are the paragraph positions in that order.
+        """
         document = Document(file_path)
-        sections = []
+        sections = SectionStore()
 
         # Parse main document paragraphs
         for idx, paragraph in enumerate(document.paragraphs):
-            sections.append({
-                "id": f"main-{idx}",  # Unique identifier for the main document
-                "title": f"Paragraph {idx+1}",
-                "content": "".join(run.text for run in paragraph.runs),
-                "style_name": paragraph.style.name if paragraph.style else None
-            })
+            sections.add(
+                "".join(run.text for run in paragraph.runs),
+                kind=SectionKind.MAIN,
+                ordinal=idx,
+                style_name=paragraph.style.name if paragraph.style else None,
+            )
 
         # Parse headers and footers
-        def parse_section(section, section_type):
+        def parse_section(section, kind):
             for idx, paragraph in enumerate(section.paragraphs):
-                sections.append({
-                    "id": f"{section_type}-{idx}",  # Unique identifier for header/footer
-                    "title": f"{section_type.capitalize()} {idx+1}",
-                    "content": "".join(run.text for run in paragraph.runs),
-                    "style_name": paragraph.style.name if paragraph.style else None
-                })
+                sections.add(
+                    "".join(run.text for run in paragraph.runs),
+                    kind=kind,
+                    ordinal=idx,
+                    style_name=paragraph.style.name if paragraph.style else None,
+                )
 
         for section in document.sections:
-            parse_section(section.header, "header")
-            parse_section(section.footer, "footer")
+            parse_section(section.header, SectionKind.HEADER)
+            parse_section(section.footer, SectionKind.FOOTER)
 
         return sections
 
@@ -169,29 +349,60 @@ class DocumentParser:
         """
         Calculates the number of tokens in a given text.
         """
-        encoding = tiktoken.encoding_for_model("gpt-4o")
-        return len(encoding.encode(text))
+        return len(get_encoding().encode(text))
 
-    def _smart_split(self, section):
+    def count_tokens(self, text):
+        return self._calculate_tokens(text)
+
+    def split_section(self, section, max_tokens):
         """
-        Splits a section into smaller sections without breaking points or sentences.
+        Splits a section into pieces of at most `max_tokens` (where sentences allow), e.g. to
+        re-chunk a section whose output was truncated.
         """
-        max_tokens = self._calculate_max_tokens()
+        return self._smart_split(section, max_tokens)
+
+    def _smart_split(self, section, max_tokens=None):
+        """
+        Splits a section into smaller sections without breaking points or sentences. Sentences
+        above the limit are cut at line feeds, then at spaces.
+        """
+        if max_tokens is None:
+            max_tokens = self._calculate_max_tokens()
         content = section["content"].strip()
-        title = section["title"]
+        title = section.get("title", "")
 
-        sentences = content.split('.')
         split_sections = []
         current_chunk = ""
+        current_tokens = 0
 
-        for sentence in sentences:
-            if self._calculate_tokens(current_chunk + sentence + '.') > max_tokens:
+        # Each piece keeps its separators, so the chunks put back together give the original text
+        for piece, tokens in self._split_pieces(content, max_tokens):
+            if current_chunk.strip() and current_tokens + tokens > max_tokens:
                 split_sections.append({"title": title, "content": current_chunk.strip()})
-                current_chunk = sentence + '.'
+                current_chunk, current_tokens = piece, tokens
             else:
-                current_chunk += sentence + '.'
+                current_chunk += piece
+                current_tokens += tokens
 
-        if current_chunk:
+        if current_chunk.strip():
             split_sections.append({"title": title, "content": current_chunk.strip()})
 
         return split_sections
+
+    def _split_pieces(self, text, max_tokens, level=0):
+        """
+        Yields (piece, tokens) of at most max_tokens, cut at the coarsest boundary that allows it.
+        """
+        for piece in re.split(_SPLIT_BOUNDARIES[level], text):
+            if not piece:
+                continue
+            tokens = self._calculate_tokens(piece)
+            if tokens <= max_tokens:
+                yield piece, tokens
+            elif level + 1 < len(_SPLIT_BOUNDARIES):
+                yield from self._split_pieces(piece, max_tokens, level + 1)
+            else:
+                # No boundary left (e.g. a long run without spaces): a token is at most 4 characters' bytes
+                step = max(1, max_tokens // 4)
+                for i in range(0, len(piece), step):
+                    yield piece[i:i + step], self._calculate_tokens(piece[i:i + step])
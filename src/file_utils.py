@@ -6,31 +6,72 @@ Utility functions for file and directory operations.
 - `ensure_directory`: Ensures a directory exists; creates it if missing.
 - `find_documents`: Recursively searches for documents in a directory 
   with specified extensions.
+- `extension_set`: Normalises a list of extensions into a set for O(1) lookups.
+- `list_directory`: Lists one directory level into supported documents and subdirectories.
+- `is_supported_document`: Tells whether a file name is a document worth processing.
+- `hash_file`: Computes the SHA-256 digest of a file's content, reading it in blocks.
 - `load_text_file`: Loads the contents of a text file as a string.
 """
 
+import hashlib
 import os
-from typing import List
+from typing import FrozenSet, Iterable, List, Tuple
 
 def ensure_directory(path: str):
     """Ensure that a directory exists, create if not."""
     if not os.path.exists(path):
         os.makedirs(path, exist_ok=True)
 
-def find_documents(directory: str, extensions: List[str]) -> List[str]:
+def find_documents(directory: str, extensions: Iterable[str]) -> List[str]:
     """
     Recursively find all documents in given directory 
     that have one of the specified extensions.
+    Walks top-down like os.walk, without following symlinked directories.
     """
+    ext_set = extension_set(extensions)
     docs = []
-    for root, dirs, files in os.walk(directory):
-        for f in files:
-            if f.startswith(".") or f.startswith("~"):
-                continue
-            if any(f.lower().endswith(ext) for ext in extensions):
-                docs.append(os.path.join(root, f))
+    stack = [directory]
+    while stack:
+        files, subdirs = list_directory(stack.pop(), ext_set)
+        docs.extend(files)
+        stack.extend(reversed(subdirs))
     return docs
 
+def extension_set(extensions: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(ext.lower() for ext in extensions)
+
+def list_directory(directory: str, ext_set: FrozenSet[str]) -> Tuple[List[str], List[str]]:
+    """
+    Single os.scandir pass over a directory.
+    Returns (supported document paths, subdirectory paths); unreadable directories are empty.
+    """
+    files, subdirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                elif is_supported_document(entry.name, ext_set):
+                    files.append(entry.path)
+    except OSError:
+        pass
+    return files, subdirs
+
+def is_supported_document(filename: str, ext_set: FrozenSet[str]) -> bool:
+    """Skip hidden and temporary (e.g. Word lock) files, keep supported extensions."""
+    if filename.startswith(".") or filename.startswith("~"):
+        return False
+    return os.path.splitext(filename)[1].lower() in ext_set
+
+def hash_file(path: str, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 def load_text_file(path: str) -> str:
     with open(path, 'r', encoding='utf-8') as f:
         return f.read()
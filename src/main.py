@@ -12,9 +12,21 @@ import logging
 import os
 from config_manager import ConfigManager
 from file_utils import find_documents, ensure_directory
-from document_parser import DocumentParser
-from openai_client import OpenAIClient
 from document_archiver import DocumentArchiver
+from pipeline import (
+    apply_overrides,
+    api_keys_configured,
+    load_processor_class,
+    create_client,
+    create_parser,
+    create_results_store,
+    resolve_docx_in_docx_mode,
+    docx_mode_for_extensions,
+    build_processor_parameters,
+    process_document,
+    process_documents,
+)
+from run_metrics import RunMetrics
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -31,137 +43,230 @@ def parse_args():
     parser.add_argument("--target-lang")
     parser.add_argument("--output-format", choices=["txt","docx"])
     parser.add_argument("--add-section-title")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Run as a long-running worker consuming jobs from the spool directory")
+    parser.add_argument("--enqueue", action="store_true",
+                        help="Submit this invocation as a job to a running daemon instead of processing it")
+    parser.add_argument("--spool-dir")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process documents that are new or changed since the last run (uses a manifest)")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Process sections shared across (or repeated within) documents only once")
+    parser.add_argument("--schedule", action="store_true",
+                        help="Pool the sections of all documents and process the largest ones first")
+    parser.add_argument("--priority", nargs="+",
+                        help="Glob patterns of documents to process first, in order of priority (implies --schedule)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and process new or modified documents as they appear in the input dir")
+    parser.add_argument("--coordinator", action="store_true",
+                        help="Enqueue the sections of all documents in the shared queue, and archive them once workers are done")
+    parser.add_argument("--worker", action="store_true",
+                        help="Process sections from the shared queue (any number of workers, on any host)")
+    parser.add_argument("--queue", help="Shared queue database used by --coordinator and --worker")
+    parser.add_argument("--export-results", action="store_true",
+                        help="Write txt/docx outputs from the results store (io.results_store) without processing")
 
     args = parser.parse_args()
     return args
 
-def load_processor_class(name):
-    if name == "ScientificReviewer":
-        from processors.scientific_reviewer import ScientificReviewer
-        return ScientificReviewer
-    elif name == "Translator":
-        from processors.translator import Translator
-        return Translator
-    elif name == "Reporter":
-        from processors.reporter import Reporter
-        return Reporter
-    elif name == "Summariser":
-        from processors.summariser import Summariser
-        return Summariser
-    elif name == "CustomPromptProcessor":
-        from processors.custom_prompt_processor import CustomPromptProcessor
-        return CustomPromptProcessor
-    
-    # GrammarReviewer as default processor, but unrecognised processors will throw an error
-    elif name == "" or name == "GrammarReviewer":
-        if (name == ""):
-            print("No reviewer defined. Will default to Grammar reviewer")
-        from processors.grammar_reviewer import GrammarReviewer
-        return GrammarReviewer
-    else:
-        raise ValueError(f"Unrecognised processor type: {name}")
-
 def main():
     args = parse_args()
     config = ConfigManager(args.config)
-    config.override("io.input_directory", args.input_dir)
-    config.override("io.output_directory", args.output_dir)
+    apply_overrides(config, vars(args))
+    config.override("daemon.spool_directory", args.spool_dir)
+    config.override("distributed.queue_path", args.queue)
+
+    if args.enqueue:
+        from worker_daemon import submit_job
+        job_path = submit_job(config.get("daemon.spool_directory", "./spool"), vars(args))
+        print(f"Job queued: {job_path}")
+        return
+
+    if args.export_results:
+        export_results(config, args.processor)
+        return
 
-    api_key = args.api_key or config.get("openai.api_key")
-    if not api_key or api_key in ["", "YOUR-OPENAI-API-KEY"]:
+    # The coordinator only parses and archives: the API keys live with the workers
+    if not args.coordinator and not api_keys_configured(config):
         raise ValueError("Valid API key not found. Provide it via CLI or in the YAML config.")
-    config.override("openai.api_key", api_key)
-
-    if args.heading_styles:
-        config.override("processing.heading_styles", args.heading_styles)
-    if args.prompt:
-        config.override("openai.prompt", args.prompt)
-    if args.processor:
-        config.override("processing.processor", args.processor)
-    if args.severity is not None:
-        config.override("processing.severity", args.severity)
-    if args.source_lang:
-        config.override("processing.source_lang", args.source_lang)
-    if args.target_lang:
-        config.override("processing.target_lang", args.target_lang)
-    if args.output_format:
-        config.override("processing.output_format", args.output_format)
-    if args.additional_prompt:
-        config.override("processing.additional_prompt", args.additional_prompt)
-    if args.add_section_title:
-        config.override("processing.add_section_title", args.add_section_title)
 
     logging_level = config.get("logging.level", "INFO")
     logging.basicConfig(level=logging_level, format='%(asctime)s - %(levelname)s - %(message)s')
 
+    if args.daemon:
+        from worker_daemon import WorkerDaemon
+        WorkerDaemon(config).run()
+        return
+
+    if args.worker:
+        run_queue_worker(config)
+        return
+
     input_dir = config.get("io.input_directory")
     output_dir = config.get("io.output_directory")
 
     ensure_directory(output_dir)
     supported_ext = config.get("io.supported_extensions", [".docx", ".txt", ".md", ".pdf"])
 
-    documents = find_documents(input_dir, supported_ext)
-    if not documents:
-        print(f"No documents found in the input dir {input_dir}")
-        return
+    incremental = args.incremental or config.get("io.incremental", False)
+    output_format = config.get("processing.output_format", "txt")
+
+    if args.watch or incremental:
+        # Documents are discovered lazily (or keep arriving), so the mode depends on
+        # what may show up rather than on what's there now
+        documents = None
+        docx_in_docx_mode = docx_mode_for_extensions(supported_ext, output_format)
+    else:
+        documents = find_documents(input_dir, supported_ext)
+        if not documents:
+            print(f"No documents found in the input dir {input_dir}")
+            return
+        docx_in_docx_mode = resolve_docx_in_docx_mode(documents, output_format)
 
     add_section_title=config.get("processing.add_section_title", True)
 
-    parser = DocumentParser(
-        heading_styles=config.get("processing.heading_styles"),
-        min_word_threshold=config.get("processing.min_word_threshold", 2)
-    )
+    parser = create_parser(config)
 
     processor_name = config.get("processing.processor", "Reviewer")
-    output_format = config.get("processing.output_format", "txt")
-
-    # Docx in docx mode: if user approves this, processed text will be saved in a formatted docx
-    docx_in_docx_mode = False
-
-    has_docx_input = any(os.path.splitext(doc)[1].lower() == ".docx" for doc in documents)
-    has_pdf_input = any(os.path.splitext(doc)[1].lower() == ".pdf" for doc in documents)
-
-    if output_format == "docx":
-        if has_docx_input:
-            logging.warning(
-                "You have chosen .docx as output format and some input files are .docx already. "
-                "This will try to recreate a file that's as loyal as possible to the original one, "
-                "and may require time. For simpler outputs, chose txt as output format instead. "
-            )
-            docx_in_docx_mode = True
-
-        if has_pdf_input:
-            logging.warning(
-                "One of the inputs is .pdf and output is .docx. Just fyi: this will NOT produce a .docx that's formatted as the .pdf"
-            )
-
-    processor_parameters = {
-        'prompt' : config.get("prompt", ''),
-        'additional_prompt' : config.get("additional_prompt", ''),
-        'severity' : config.get("processing.severity", 3),
-        'source_lang' : config.get("processing.source_lang", "en"),
-        'target_lang' : config.get("processing.target_lang", "en"),
-        'docx_in_docx_mode' : docx_in_docx_mode
-    }
-
-    api_key = config.get("openai.api_key")
-    model = config.get("openai.model")
-    max_retries = config.get("openai.max_retries", 3)
+    processor_parameters = build_processor_parameters(config, docx_in_docx_mode)
 
     ProcessorClass = load_processor_class(processor_name)
     if not ProcessorClass:
         return
 
-    client = OpenAIClient(api_key, model, max_retries)
+    metrics = RunMetrics()
+    client = None if args.coordinator else create_client(config, metrics)
     processor = ProcessorClass(client, processor_parameters)
     print(f"Chosen processor class: {processor.__class__.__name__}")
 
-    for doc_path in documents:
-        print(f"Processing {doc_path}")
-        sections = parser.parse_document(doc_path, docx_in_docx_mode=docx_in_docx_mode)
-        results = processor.process_sections(sections)
-        archiver = DocumentArchiver(output_dir, output_format, add_section_title, docx_in_docx_mode)
-        archiver.archive_document(doc_path, sections, results, processor)
+    archiver = DocumentArchiver(output_dir, output_format, add_section_title, docx_in_docx_mode,
+                                create_results_store(config))
+    deduplicate = args.dedupe or config.get("processing.deduplicate_sections", False)
+    schedule = args.schedule or config.get("processing.schedule_largest_first", False)
+    priorities = args.priority or config.get("processing.priority_patterns", [])
+
+    if args.coordinator:
+        run_coordinator(config, documents if documents is not None else find_documents(input_dir, supported_ext),
+                        parser, processor, archiver, docx_in_docx_mode, processor_name, processor_parameters)
+        return
+    if args.watch:
+        watch_documents(config, input_dir, supported_ext, parser, processor, archiver, docx_in_docx_mode)
+        return
+    if incremental:
+        process_incremental(config, input_dir, supported_ext, parser, processor, archiver, docx_in_docx_mode,
+                            metrics, deduplicate, schedule, priorities)
+    else:
+        process_documents(documents, parser, processor, archiver, docx_in_docx_mode, metrics, deduplicate,
+                          schedule, priorities)
+
+    print(metrics.report())
+
+def open_manifest(config, processor, archiver):
+    """
+    Returns the DocumentManifest of the output directory (or io.manifest_path), and the key
+    documents processed with this processor and output format are marked with.
+    """
+    from document_discovery import DocumentManifest
+    manifest_path = config.get("io.manifest_path") or os.path.join(archiver.output_dir, ".documents_manifest.json")
+    # The same tree can be processed by several processors/formats, each keeping track of its own work
+    return DocumentManifest(manifest_path), f"{processor.output_suffix()}.{archiver.output_format}"
+
+def process_incremental(config, input_dir, supported_ext, parser, processor, archiver, docx_in_docx_mode,
+                        metrics, deduplicate, schedule, priorities):
+    from document_discovery import iter_documents
+    manifest, processed_key = open_manifest(config, processor, archiver)
+
+    documents = iter_documents(input_dir, supported_ext, manifest, processed_key,
+                               trust_directory_mtime=config.get("io.trust_directory_mtime", False))
+    try:
+        process_documents(documents, parser, processor, archiver, docx_in_docx_mode, metrics, deduplicate,
+                          schedule, priorities,
+                          on_document_done=lambda doc_path: manifest.mark_processed(doc_path, processed_key))
+    finally:
+        manifest.save()
+
+    if not metrics.get("documents_processed"):
+        print(f"No new or modified documents in the input dir {input_dir}")
+
+def export_results(config, processor_name=None):
+    results_store = create_results_store(config)
+    if results_store is None:
+        raise ValueError("No results store configured (io.results_store)")
+    output_dir = config.get("io.output_directory")
+    ensure_directory(output_dir)
+    output_format = config.get("processing.output_format", "txt")
+    # Each document is written the way it was processed (paragraph-level results are recorded as such)
+    archiver = DocumentArchiver(output_dir, output_format, config.get("processing.add_section_title", True))
+    ProcessorClass = load_processor_class(processor_name) if processor_name else None
+    exported = archiver.export_results(results_store, ProcessorClass.__name__ if ProcessorClass else None)
+    results_store.close()
+    print(f"Exported {exported} documents from {results_store.path} to {output_dir}")
+
+def open_work_queue(config):
+    from work_queue import WorkQueue
+    return WorkQueue(
+        config.get("distributed.queue_path", "./work_queue.sqlite"),
+        lease_seconds=config.get("distributed.lease_seconds", 60.0),
+        max_attempts=config.get("distributed.max_attempts", 3),
+    )
+
+def run_coordinator(config, documents, parser, processor, archiver, docx_in_docx_mode, processor_name,
+                    processor_parameters):
+    from distributed import Coordinator
+    queue = open_work_queue(config)
+    coordinator = Coordinator(queue, parser, processor, archiver, docx_in_docx_mode,
+                              poll_interval=config.get("distributed.poll_interval", 1.0))
+    run_id = coordinator.enqueue(documents, processor_name, processor_parameters)
+    print(f"Waiting for workers on {queue.path}")
+    archived = coordinator.finalise(run_id)
+    print(f"Archived {archived} documents, tasks: {queue.counts()}")
+
+def run_queue_worker(config):
+    from distributed import QueueWorker
+    metrics = RunMetrics()
+    client = create_client(config, metrics)
+    worker = QueueWorker(
+        open_work_queue(config),
+        client,
+        batch_size=config.get("distributed.claim_batch") or None,
+        poll_interval=config.get("distributed.poll_interval", 1.0),
+        exit_when_idle=config.get("distributed.worker_exit_when_idle", True),
+    )
+    print(f"Worker {worker.worker_id} processing {worker.queue.path}")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        print("Worker stopped")
+    finally:
+        client.close()
+    print(metrics.report())
+
+def watch_documents(config, input_dir, supported_ext, parser, processor, archiver, docx_in_docx_mode):
+    from directory_watcher import DirectoryWatcher
+    manifest, processed_key = open_manifest(config, processor, archiver)
+    watcher = DirectoryWatcher(
+        input_dir,
+        supported_ext,
+        debounce_seconds=config.get("watch.debounce_seconds", 2.0),
+        poll_interval=config.get("watch.poll_interval", 5.0),
+        process_existing=config.get("watch.process_existing", True),
+        use_inotify=config.get("watch.use_inotify", True),
+        manifest=manifest,
+        processed_key=processed_key,
+    )
+    try:
+        for doc_path in watcher.watch():
+            try:
+                process_document(doc_path, parser, processor, archiver, docx_in_docx_mode)
+            except Exception as e:
+                # A broken document must not take the whole service down
+                logging.error(f"Failed to process {doc_path}: {e}")
+                continue
+            # Saved after every document, so a restart doesn't process it again
+            manifest.mark_processed(doc_path, processed_key)
+            manifest.save()
+    except KeyboardInterrupt:
+        print("Watch mode stopped")
 
 if __name__ == "__main__":
     main()
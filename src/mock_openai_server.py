@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+"""
+MockOpenAIServer: a local, deterministic stand-in for the chat completions endpoint.
+
+Meant for exercising the client machinery (concurrency control, retries, throughput)
+without spending tokens: point `openai.base_url` at it.
+
+- Answers POST .../chat/completions with an OpenAI-shaped response echoing the user message.
+- Simulates a limited capacity: above `capacity` concurrent requests it either answers 429
+  (`overload="throttle"`) or slows down proportionally (`overload="slow"`).
+- Latency is `base_latency + latency_per_prompt_token * uncached prompt tokens +
+  latency_per_token * completion tokens` (tokens = words).
+- Tail latency: every `straggler_every`-th request takes `straggler_latency` seconds instead.
+- Prompt caching (`prompt_caching=True`): like the real endpoint, the longest previously seen
+  prompt prefix of at least `cache_min_tokens`, in steps of `cache_block_tokens`, is served
+  from cache and reported in usage.prompt_tokens_details.cached_tokens.
+- Output limit (`max_output_tokens`): longer answers are cut there, with finish_reason "length".
+
+    python src/mock_openai_server.py --port 8000 --capacity 8
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prefixes remembered by the simulated prompt cache
+_PROMPT_CACHE_ENTRIES = 10000
+
+class MockOpenAIServer:
+    def __init__(self, host="127.0.0.1", port=0, capacity=8, overload="throttle",
+                 base_latency=0.05, latency_per_token=0.0, straggler_every=0, straggler_latency=5.0,
+                 prompt_caching=False, cache_min_tokens=1024, cache_block_tokens=128,
+                 latency_per_prompt_token=0.0, max_output_tokens=0):
+        """
+        :param port: Port to listen on, 0 picks a free one.
+        :param capacity: Concurrent requests served at full speed.
+        :param overload: "throttle" (answer 429) or "slow" (stretch latency) above capacity.
+        :param base_latency: Seconds spent on every request.
+        :param latency_per_token: Extra seconds per completion token.
+        :param straggler_every: Every n-th request is a straggler (0 disables).
+        :param straggler_latency: Seconds a straggler takes.
+        :param prompt_caching: Simulate provider-side prompt prefix caching.
+        :param cache_min_tokens: Shortest prefix that gets cached.
+        :param cache_block_tokens: Cached prefixes grow in steps of this many tokens.
+        :param latency_per_prompt_token: Extra seconds per prompt token not served from cache.
+        :param max_output_tokens: Completion tokens after which answers are truncated (0 disables).
+        """
+        self.capacity = capacity
+        self.overload = overload
+        self.base_latency = base_latency
+        self.latency_per_token = latency_per_token
+        self.straggler_every = straggler_every
+        self.straggler_latency = straggler_latency
+        self.prompt_caching = prompt_caching
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_block_tokens = cache_block_tokens
+        self.latency_per_prompt_token = latency_per_prompt_token
+        self.max_output_tokens = max_output_tokens
+        self._prompt_cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.stats = {"requests": 0, "throttled": 0, "max_in_flight": 0, "cached_tokens": 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def complete(self, request):
+        """
+        Builds the (status, payload) answer for a chat completions request.
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+            request_number = self.stats["requests"]
+            self.in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+            load = self.in_flight
+        try:
+            if load > self.capacity and self.overload == "throttle":
+                with self.lock:
+                    self.stats["throttled"] += 1
+                return 429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error",
+                                       "code": "rate_limit_exceeded"}}
+
+            messages = request.get("messages", [])
+            user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+            prompt = [word for m in messages for word in [f"<{m.get('role')}>", *str(m.get("content", "")).split()]]
+            prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+            answer = user
+            finish_reason = "stop"
+            completion_tokens = len(user.split())
+            if self.max_output_tokens and completion_tokens > self.max_output_tokens:
+                answer = " ".join(user.split()[:self.max_output_tokens])
+                finish_reason = "length"
+                completion_tokens = self.max_output_tokens
+            cached_tokens = min(self._cached_prefix(prompt), prompt_tokens)
+
+            latency = (self.base_latency + self.latency_per_prompt_token * (prompt_tokens - cached_tokens)
+                       + self.latency_per_token * completion_tokens)
+            if load > self.capacity:
+                latency *= load / self.capacity
+            if self.straggler_every and request_number % self.straggler_every == 0:
+                latency = self.straggler_latency
+            time.sleep(latency)
+
+            return 200, {
+                "id": f"chatcmpl-mock-{request_number}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": cached_tokens},
+                },
+            }
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def _cached_prefix(self, prompt):
+        """
+        Looks up the longest cached prefix of the prompt (a list of tokens), caches all of its
+        block-aligned prefixes, and returns the number of cached tokens.
+        """
+        if not self.prompt_caching:
+            return 0
+        digest = hashlib.sha256()
+        boundaries = []
+        for start in range(0, len(prompt) - self.cache_block_tokens + 1, self.cache_block_tokens):
+            digest.update("\x00".join(prompt[start:start + self.cache_block_tokens]).encode("utf-8") + b"\x01")
+            end = start + self.cache_block_tokens
+            if end >= self.cache_min_tokens:
+                boundaries.append((end, digest.hexdigest()))
+
+        cached = 0
+        contiguous = True  # Only an unbroken run of cached blocks from the start counts
+        with self.lock:
+            for end, key in boundaries:
+                if key in self._prompt_cache:
+                    self._prompt_cache.move_to_end(key)
+                    if contiguous:
+                        cached = end
+                else:
+                    contiguous = False
+                    self._prompt_cache[key] = True
+            while len(self._prompt_cache) > _PROMPT_CACHE_ENTRIES:
+                self._prompt_cache.popitem(last=False)
+            self.stats["cached_tokens"] += cached
+        return cached
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoint
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.rstrip("/").endswith("/chat/completions"):
+                    status, payload = server.complete(body)
+                else:
+                    status, payload = 404, {"error": {"message": f"Unknown path {self.path}"}}
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (ConnectionResetError, BrokenPipeError):
+                    pass  # Client gave up (timeout or hedged duplicate), nothing to answer
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--overload", choices=["throttle", "slow"], default="throttle")
+    parser.add_argument("--base-latency", type=float, default=0.05)
+    parser.add_argument("--latency-per-token", type=float, default=0.0)
+    parser.add_argument("--straggler-every", type=int, default=0)
+    parser.add_argument("--straggler-latency", type=float, default=5.0)
+    parser.add_argument("--prompt-caching", action="store_true")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024)
+    parser.add_argument("--cache-block-tokens", type=int, default=128)
+    parser.add_argument("--latency-per-prompt-token", type=float, default=0.0)
+    parser.add_argument("--max-output-tokens", type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.host, args.port, args.capacity, args.overload,
+                              args.base_latency, args.latency_per_token,
+                              args.straggler_every, args.straggler_latency,
+                              args.prompt_caching, args.cache_min_tokens, args.cache_block_tokens,
+                              args.latency_per_prompt_token, args.max_output_tokens)
+    print(f"Mock OpenAI endpoint listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -6,41 +6,318 @@ A client wrapper for OpenAI's API to handle chat-based completions.
 - Supports retry logic for API calls with configurable maximum retries.
 - Allows interaction via system and user prompts.
 - Handles errors and logs failures for debugging.
+- Owns its own HTTP connection pools (keep-alive), so it can be kept warm and shared
+  between threads and jobs, with a shared concurrency and rate budget.
+- Requests can be spread over a pool of (endpoint, api key, model) backends, each with its
+  own rate budget and health state (see BackendPool).
+- In-flight requests are bounded by an AdaptiveConcurrencyController, which can adapt
+  the limit (AIMD) to observed latency and throttling.
+- Every request has a deadline scaled to its expected output length.
+- Retries are classified: timeouts, connection errors, 429 and 5xx are retried with
+  exponential backoff; authentication errors abort the run, other 4xx fail the request.
+- Optional hedging: a request still running after the observed p95 latency gets a
+  duplicate, and whichever answers first wins.
+- Token usage is recorded, including the prompt tokens served from the provider's prompt
+  cache, with separate latency percentiles for calls that hit the cache and calls that didn't.
+- Responses cut at the model's output limit (finish_reason "length") are logged and counted.
 """
 
+import random
+import threading
+import time
 import openai
 import logging
+from backend_pool import Backend, BackendPool
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, wait
+from concurrency_controller import AdaptiveConcurrencyController, SUCCESS, THROTTLED, ERROR
+from run_metrics import LatencyTracker
+
+# Errors that a retry cannot fix: the whole run is misconfigured
+FATAL_ERRORS = (openai.AuthenticationError, openai.PermissionDeniedError)
+# Errors that a retry cannot fix for this request (invalid request, too long, unknown model...)
+NON_RETRYABLE_ERRORS = (openai.BadRequestError, openai.NotFoundError, openai.UnprocessableEntityError)
+
+class BackendUnavailableError(Exception):
+    """
+    A backend of the pool can't serve requests anymore, another one should be tried.
+    """
+
+# Hedging needs enough samples for a meaningful p95, and may duplicate at most this share of calls
+HEDGE_MIN_SAMPLES = 20
+HEDGE_BUDGET = 0.1
 
 class OpenAIClient:
-    def __init__(self, api_key, model, max_retries=3):
-        if api_key == "YOUR-OPENAI-API-KEY" or api_key == "":
-            raise ValueError("You need to define an OpenAI api key")
-        
-        openai.api_key = api_key
-        self.client = openai
+    def __init__(self, api_key, model, max_retries=3, base_url=None, max_concurrency=8,
+                 requests_per_minute=None, max_connections=None, adaptive_concurrency=False,
+                 initial_concurrency=None, metrics=None, timeout_base_seconds=30.0,
+                 min_output_tokens_per_second=15.0, hedge_requests=False, max_backoff_seconds=30.0,
+                 backends=None, backend_failure_threshold=3, backend_ejection_seconds=30.0):
+        """
+        :param api_key: OpenAI api key.
+        :param model: Model used for completions.
+        :param max_retries: Maximum attempts for each completion.
+        :param base_url: Optional API endpoint, defaults to OpenAI's.
+        :param max_concurrency: Maximum in-flight requests shared by all callers of this client (at least 1).
+        :param requests_per_minute: Optional rate budget shared by all callers of this client.
+        :param max_connections: Size of the keep-alive connection pool (defaults to max_concurrency).
+        :param adaptive_concurrency: Adapt the in-flight limit (up to max_concurrency) to latency and throttling.
+        :param initial_concurrency: Starting limit in adaptive mode.
+        :param metrics: Optional RunMetrics receiving call, latency and concurrency statistics.
+        :param timeout_base_seconds: Fixed part of every request deadline.
+        :param min_output_tokens_per_second: Slowest acceptable generation speed, scales the deadline.
+        :param hedge_requests: Send a duplicate of requests slower than the observed p95 latency.
+        :param max_backoff_seconds: Upper bound for the wait between retries.
+        :param backends: Optional list of backend dicts (name, api_key, base_url, model, weight,
+                         requests_per_minute, max_concurrency); missing values default to the
+                         arguments above. Without it, the client has a single backend.
+        :param backend_failure_threshold: Consecutive failures ejecting a backend.
+        :param backend_ejection_seconds: First ejection time of a failing backend.
+        """
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1, got {max_concurrency}")
+        pool_size = max_connections or max_concurrency
+        # Retries are handled here, so throttling is visible to the concurrency controller and the pool
+        self.backends = BackendPool(
+            [
+                Backend(
+                    name=b.get("name") or f"backend{i + 1}",
+                    api_key=b.get("api_key", api_key),
+                    model=b.get("model") or model,
+                    base_url=b.get("base_url") or base_url,
+                    weight=b.get("weight", 1.0),
+                    requests_per_minute=b.get("requests_per_minute", requests_per_minute),
+                    max_concurrency=b.get("max_concurrency"),
+                    max_connections=b.get("max_concurrency") or pool_size,
+                )
+                for i, b in enumerate(backends or [{"name": "default"}])
+            ],
+            failure_threshold=backend_failure_threshold,
+            ejection_seconds=backend_ejection_seconds,
+            metrics=metrics if backends else None,
+        )
         self.model = model
         self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics
+        self.concurrency = AdaptiveConcurrencyController(
+            initial_limit=(initial_concurrency or max(1, max_concurrency // 4)) if adaptive_concurrency else max_concurrency,
+            max_limit=max_concurrency,
+            adaptive=adaptive_concurrency,
+            metrics=metrics,
+        )
+        self.timeout_base_seconds = timeout_base_seconds
+        self.min_output_tokens_per_second = min_output_tokens_per_second
+        self.max_backoff_seconds = max_backoff_seconds
+        self.latency = LatencyTracker()
+        self.cached_latency = LatencyTracker()
+        self.uncached_latency = LatencyTracker()
+        self.hedge_requests = hedge_requests
+        self._hedge_executor = ThreadPoolExecutor(max_workers=2 * max_concurrency) if hedge_requests else None
+        self._hedge_lock = threading.Lock()
+        self._hedges_sent = 0
+        self._calls_seen = 0
 
-    def get_completion(self, system_prompt, user_prompt):
+    def get_completion(self, system_prompt, user_prompt, expected_output_ratio=1.0, cache_key=None, details=None):
+        """
+        :param expected_output_ratio: Expected output tokens per input token, scales the deadline.
+        :param cache_key: Optional prompt_cache_key, routing requests sharing a prompt prefix to
+                          the same provider cache.
+        :param details: Optional dict, filled with the model, finish_reason and token usage of
+                        the successful call.
+        """
+        timeout = self.request_timeout(user_prompt, expected_output_ratio)
         attempt = 0
         response = None
 
         while attempt < self.max_retries and response is None:
             try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ]
-                )
+                response = self._complete(system_prompt, user_prompt, timeout, cache_key)
                 if not response.choices:
                     raise ValueError("No valid response")
+            except FATAL_ERRORS as e:
+                logging.error(f"API call rejected, check the api key and model: {e}")
+                raise
+            except NON_RETRYABLE_ERRORS as e:
+                logging.error(f"API call failed, not retrying: {e}")
+                return None
             except Exception as e:
                 logging.error(f"Error in API call at attempt {attempt + 1}: {e}")
                 response = None
                 attempt += 1
+                if attempt < self.max_retries:
+                    time.sleep(self._backoff(attempt, e))
 
         if response and response.choices and response.choices[0].message.content:
+            if response.choices[0].finish_reason == "length":
+                # Cut at the model's output limit: callers can tell from details["finish_reason"]
+                logging.warning("Response truncated at the output token limit")
+                if self.metrics is not None:
+                    self.metrics.increment("truncated_responses")
+            if details is not None:
+                self._fill_details(details, response)
             return response.choices[0].message.content.strip()
-        return None
\ No newline at end of file
+        return None
+
+    def _fill_details(self, details, response):
+        usage = getattr(response, "usage", None)
+        prompt_details = getattr(usage, "prompt_tokens_details", None)
+        details["model"] = getattr(response, "model", None) or self.model
+        details["finish_reason"] = response.choices[0].finish_reason
+        details["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+        details["completion_tokens"] = getattr(usage, "completion_tokens", None)
+        details["cached_tokens"] = getattr(prompt_details, "cached_tokens", None)
+
+    def request_timeout(self, user_prompt, expected_output_ratio=1.0):
+        # ~4 characters per token is close enough for a deadline
+        expected_output_tokens = len(user_prompt) / 4 * expected_output_ratio
+        return self.timeout_base_seconds + expected_output_tokens / self.min_output_tokens_per_second
+
+    def _backoff(self, attempt, error):
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff_seconds)
+        # Exponential backoff with full jitter, so throttled workers don't retry in lockstep
+        return random.uniform(0, min(self.max_backoff_seconds, 0.5 * 2 ** attempt))
+
+    def _complete(self, system_prompt, user_prompt, timeout, cache_key=None):
+        hedge_after = None
+        if self.hedge_requests and self.latency.count() >= HEDGE_MIN_SAMPLES:
+            hedge_after = self.latency.percentile(0.95)
+        if hedge_after is None:
+            return self._create_completion(system_prompt, user_prompt, timeout, cache_key=cache_key)
+        with self._hedge_lock:
+            self._calls_seen += 1
+
+        # The hedge delay runs from when the request is actually sent, not from when it was queued
+        started = threading.Event()
+        primary = self._hedge_executor.submit(self._create_completion, system_prompt, user_prompt, timeout, started, cache_key)
+        started.wait()
+        try:
+            return primary.result(timeout=hedge_after)
+        except FuturesTimeoutError:
+            pass
+        if not self._take_hedge_budget():
+            return primary.result()
+
+        # Straggler: race a duplicate against it, the slower one is simply discarded
+        hedge = self._hedge_executor.submit(self._create_completion, system_prompt, user_prompt, timeout, None, cache_key)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is hedge:
+                    self._count("hedged_calls_won")
+                return response
+        raise error
+
+    def _take_hedge_budget(self):
+        with self._hedge_lock:
+            if self._hedges_sent >= HEDGE_BUDGET * self._calls_seen:
+                return False
+            self._hedges_sent += 1
+        self._count("api_calls_hedged")
+        return True
+
+    def _create_completion(self, system_prompt, user_prompt, timeout, started_event=None, cache_key=None):
+        # The concurrency slot comes first: a request only counts as in flight on a backend
+        # once it is actually about to be sent, so the least-loaded choice sees real load
+        ticket = self.concurrency.acquire()
+        backend = self.backends.acquire()  # Waits for a backend slot or rate budget if needed
+        if started_event is not None:
+            started_event.set()
+        started = time.monotonic()
+        outcome = ERROR
+        healthy = False
+        response = None
+        try:
+            response = backend.client.chat.completions.create(
+                model=backend.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                timeout=timeout,
+                # Not a named argument in this SDK version, sent as is
+                extra_body={"prompt_cache_key": cache_key} if cache_key else None,
+            )
+            outcome = SUCCESS
+            healthy = True
+            return response
+        except FATAL_ERRORS as e:
+            healthy = None
+            if len(self.backends.backends) > 1 and self.backends.disable(backend):
+                # Only this backend's key is rejected: retry on the others
+                raise BackendUnavailableError(f"Backend {backend.name} rejected the request: {e}") from e
+            raise e
+        except NON_RETRYABLE_ERRORS as e:
+            healthy = None  # The request is at fault, not the backend
+            raise e
+        except (openai.RateLimitError, openai.InternalServerError) as e:
+            outcome = THROTTLED
+            raise e
+        except openai.APITimeoutError as e:
+            outcome = THROTTLED  # An endpoint too slow to answer is congested
+            self._count("api_calls_timed_out")
+            raise e
+        finally:
+            latency = time.monotonic() - started
+            self.backends.release(backend, healthy)
+            self.concurrency.release(ticket, outcome, latency)
+            if outcome == SUCCESS:
+                self.latency.record(latency)
+                self._record_usage(response, latency)
+            self._record_call(outcome)
+
+    def _record_call(self, outcome):
+        if self.metrics is None:
+            return
+        self.metrics.increment("api_calls")
+        if outcome == THROTTLED:
+            self.metrics.increment("api_calls_throttled")
+        elif outcome == ERROR:
+            self.metrics.increment("api_calls_failed")
+        elif outcome == SUCCESS:
+            for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                self.metrics.set(f"latency_{name}_seconds", self.latency.percentile(q))
+
+    def _record_usage(self, response, latency):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        (self.cached_latency if cached_tokens else self.uncached_latency).record(latency)
+        if self.metrics is None:
+            return
+        self.metrics.increment("prompt_tokens", usage.prompt_tokens or 0)
+        self.metrics.increment("cached_prompt_tokens", cached_tokens)
+        self.metrics.increment("completion_tokens", usage.completion_tokens or 0)
+        if cached_tokens:
+            self.metrics.increment("api_calls_with_cached_prompt")
+            self.metrics.set("latency_cached_p50_seconds", self.cached_latency.percentile(0.5))
+        else:
+            self.metrics.set("latency_uncached_p50_seconds", self.uncached_latency.percentile(0.5))
+        prompt_tokens = self.metrics.get("prompt_tokens")
+        if prompt_tokens:
+            self.metrics.set("prompt_cache_hit_rate", self.metrics.get("cached_prompt_tokens") / prompt_tokens)
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.increment(name)
+
+    def close(self):
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+        self.backends.close()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+"""
+Shared building blocks for a processing run, used both by the one-shot CLI (main.py)
+and by the long-running worker daemon.
+
+- `apply_overrides`: applies CLI arguments or job parameters on top of the YAML config.
+- `load_processor_class`: resolves a processor name into its class.
+- `create_client` / `create_parser`: build the OpenAI client and document parser from config.
+- `create_results_store`: opens the structured results store, if one is configured.
+- `resolve_docx_in_docx_mode`: decides whether .docx outputs are rebuilt from .docx inputs.
+- `docx_mode_for_extensions`: same decision when documents are discovered lazily.
+- `build_processor_parameters`: collects the parameters handed to processors, including the
+  reference material (glossary, style guide, context summary) of the prompt prefix.
+- `process_document`: parses, processes and archives a single document.
+- `process_documents`: processes a batch of documents, optionally deduplicating sections across
+  them and scheduling them largest first.
+"""
+
+import os
+import logging
+from document_parser import DocumentParser
+from openai_client import OpenAIClient
+from file_utils import load_text_file
+from section_cache import SectionCache
+from section_deduplicator import SectionDeduplicator
+from section_scheduler import SectionScheduler, document_priority
+
+# Reference material added to the system prompt: (title in the prompt, processing.* config key)
+REFERENCE_MATERIAL_FILES = (
+    ("Glossary", "glossary_file"),
+    ("Style guide", "style_guide_file"),
+    ("Context summary", "context_summary_file"),
+)
+
+def apply_overrides(config, values):
+    """
+    Applies overrides (CLI arguments or daemon job parameters) to a ConfigManager.
+    Missing or empty values leave the config untouched.
+    """
+    config.override("io.input_directory", values.get("input_dir"))
+    config.override("io.output_directory", values.get("output_dir"))
+    if values.get("api_key"):
+        config.override("openai.api_key", values["api_key"])
+    if values.get("heading_styles"):
+        config.override("processing.heading_styles", values["heading_styles"])
+    if values.get("prompt"):
+        config.override("openai.prompt", values["prompt"])
+    if values.get("processor"):
+        config.override("processing.processor", values["processor"])
+    if values.get("severity") is not None:
+        config.override("processing.severity", values["severity"])
+    if values.get("source_lang"):
+        config.override("processing.source_lang", values["source_lang"])
+    if values.get("target_lang"):
+        config.override("processing.target_lang", values["target_lang"])
+    if values.get("output_format"):
+        config.override("processing.output_format", values["output_format"])
+    if values.get("additional_prompt"):
+        config.override("processing.additional_prompt", values["additional_prompt"])
+    if values.get("add_section_title"):
+        config.override("processing.add_section_title", values["add_section_title"])
+
+def load_processor_class(name):
+    if name == "ScientificReviewer":
+        from processors.scientific_reviewer import ScientificReviewer
+        return ScientificReviewer
+    elif name == "Translator":
+        from processors.translator import Translator
+        return Translator
+    elif name == "Reporter":
+        from processors.reporter import Reporter
+        return Reporter
+    elif name == "Summariser":
+        from processors.summariser import Summariser
+        return Summariser
+    elif name == "CustomPromptProcessor":
+        from processors.custom_prompt_processor import CustomPromptProcessor
+        return CustomPromptProcessor
+
+    # GrammarReviewer as default processor, but unrecognised processors will throw an error
+    elif name == "" or name == "GrammarReviewer":
+        if (name == ""):
+            print("No reviewer defined. Will default to Grammar reviewer")
+        from processors.grammar_reviewer import GrammarReviewer
+        return GrammarReviewer
+    else:
+        raise ValueError(f"Unrecognised processor type: {name}")
+
+def api_keys_configured(config):
+    """
+    True if every request has an api key: the top-level one, or each backend's own.
+    """
+    if _is_api_key(config.get("openai.api_key")):
+        return True
+    backends = config.get("openai.backends") or []
+    return bool(backends) and all(_is_api_key(b.get("api_key")) for b in backends)
+
+def _is_api_key(value):
+    return bool(value) and value != "YOUR-OPENAI-API-KEY"
+
+def create_client(config, metrics=None):
+    return OpenAIClient(
+        config.get("openai.api_key"),
+        config.get("openai.model"),
+        config.get("openai.max_retries", 3),
+        base_url=config.get("openai.base_url"),
+        max_concurrency=config.get("openai.max_concurrency", 8),
+        requests_per_minute=config.get("openai.requests_per_minute"),
+        adaptive_concurrency=config.get("openai.adaptive_concurrency", False),
+        initial_concurrency=config.get("openai.initial_concurrency"),
+        metrics=metrics,
+        timeout_base_seconds=config.get("openai.timeout_base_seconds", 30.0),
+        min_output_tokens_per_second=config.get("openai.min_output_tokens_per_second", 15.0),
+        hedge_requests=config.get("openai.hedge_requests", False),
+        backends=config.get("openai.backends") or None,
+        backend_failure_threshold=config.get("openai.backend_failure_threshold", 3),
+        backend_ejection_seconds=config.get("openai.backend_ejection_seconds", 30.0),
+    )
+
+def create_parser(config):
+    cache = None
+    cache_dir = config.get("cache.directory")
+    if cache_dir:
+        cache = SectionCache(cache_dir, config.get("cache.max_size_mb", 512) * 1024 * 1024)
+    return DocumentParser(
+        heading_styles=config.get("processing.heading_styles"),
+        min_word_threshold=config.get("processing.min_word_threshold", 2),
+        cache=cache
+    )
+
+def create_results_store(config):
+    path = config.get("io.results_store")
+    if not path:
+        return None
+    from results_store import ResultsStore
+    return ResultsStore(path)
+
+def resolve_docx_in_docx_mode(documents, output_format):
+    """
+    Docx in docx mode: if user approves this, processed text will be saved in a formatted docx
+    """
+    docx_in_docx_mode = False
+
+    has_docx_input = any(os.path.splitext(doc)[1].lower() == ".docx" for doc in documents)
+    has_pdf_input = any(os.path.splitext(doc)[1].lower() == ".pdf" for doc in documents)
+
+    if output_format == "docx":
+        if has_docx_input:
+            logging.warning(
+                "You have chosen .docx as output format and some input files are .docx already. "
+                "This will try to recreate a file that's as loyal as possible to the original one, "
+                "and may require time. For simpler outputs, chose txt as output format instead. "
+            )
+            docx_in_docx_mode = True
+
+        if has_pdf_input:
+            logging.warning(
+                "One of the inputs is .pdf and output is .docx. Just fyi: this will NOT produce a .docx that's formatted as the .pdf"
+            )
+
+    return docx_in_docx_mode
+
+def docx_mode_for_extensions(supported_ext, output_format):
+    """
+    Docx in docx mode when the document list isn't known upfront (watch/incremental runs)
+    """
+    return output_format == "docx" and ".docx" in [ext.lower() for ext in supported_ext]
+
+def build_processor_parameters(config, docx_in_docx_mode):
+    return {
+        'prompt' : config.get("prompt", ''),
+        'additional_prompt' : config.get("additional_prompt", ''),
+        'severity' : config.get("processing.severity", 3),
+        'source_lang' : config.get("processing.source_lang", "en"),
+        'target_lang' : config.get("processing.target_lang", "en"),
+        'docx_in_docx_mode' : docx_in_docx_mode,
+        'prompt_prefix_caching' : config.get("processing.prompt_prefix_caching", False),
+        'reference_material' : load_reference_material(config),
+        'rechunk_truncated' : config.get("processing.rechunk_truncated_outputs", True),
+    }
+
+def load_reference_material(config):
+    material = []
+    for title, key in REFERENCE_MATERIAL_FILES:
+        path = config.get(f"processing.{key}", "")
+        if path:
+            material.append((title, load_text_file(path)))
+    return material
+
+def process_document(doc_path, parser, processor, archiver, docx_in_docx_mode):
+    print(f"Processing {doc_path}")
+    # Text and markdown sections are streamed: processing starts while the file is still being read
+    sections = parser.iter_sections(doc_path, docx_in_docx_mode=docx_in_docx_mode)
+    # Results reach the results store (if any) as they complete, not only once the document is done
+    recorder = archiver.result_recorder(doc_path, processor)
+    results = processor.process_sections(sections, on_result=recorder.add if recorder else None)
+    archiver.archive_document(doc_path, sections, results, processor, recorder)
+
+def process_documents(documents, parser, processor, archiver, docx_in_docx_mode, metrics=None,
+                      deduplicate=False, schedule=False, priorities=None, on_document_done=None):
+    """
+    Processes a batch of documents.
+
+    - `deduplicate`: sections shared across (or repeated within) documents are processed only once.
+    - `schedule`: sections of all documents are pooled and dispatched largest first, documents
+      matching the earlier `priorities` glob patterns first.
+
+    Both need all documents parsed upfront. `on_document_done(doc_path)` is called once a
+    document has been archived.
+    """
+    deduplicate = deduplicate and SectionDeduplicator.supports(processor)
+    schedule = (schedule or bool(priorities)) and SectionScheduler.supports(processor)
+
+    def archive(doc_index, results):
+        doc_path = documents[doc_index]
+        archiver.archive_document(doc_path, sections_by_document[doc_index], results, processor, recorders[doc_index])
+        if metrics is not None:
+            metrics.increment("documents_processed")
+        if on_document_done:
+            on_document_done(doc_path)
+
+    if not (deduplicate or schedule):
+        for doc_path in documents:
+            process_document(doc_path, parser, processor, archiver, docx_in_docx_mode)
+            if metrics is not None:
+                metrics.increment("documents_processed")
+            if on_document_done:
+                on_document_done(doc_path)
+        return
+
+    documents = list(documents)
+    sections_by_document = []
+    for doc_path in documents:
+        print(f"Parsing {doc_path}")
+        sections_by_document.append(parser.parse_document(doc_path, docx_in_docx_mode=docx_in_docx_mode))
+
+    scheduler = SectionScheduler(processor, metrics=metrics) if schedule else None
+    recorders = [archiver.result_recorder(doc_path, processor) for doc_path in documents]
+
+    def record(doc_index, position, result):
+        if recorders[doc_index] is not None:
+            recorders[doc_index].add(position, result)
+
+    if deduplicate:
+        # Every document is archived at the end here, so priorities don't apply
+        runner = scheduler.process_sections if scheduler else None
+        results_by_document = SectionDeduplicator(processor, metrics, runner).process(sections_by_document, record)
+        for doc_index, results in enumerate(results_by_document):
+            archive(doc_index, results)
+        return
+
+    scheduler.run(
+        sections_by_document,
+        priorities=[document_priority(doc_path, priorities) for doc_path in documents],
+        on_document_done=archive,
+        on_result=record,
+    )
@@ -5,41 +5,259 @@ BaseOpenAIProcessor class provides an OpenAI-dependent framework for processing
 
 - Specific BaseProcessor, designed to handle OpenAI client interactions with custom prompts.
 - Intended to be extended by specific processors like translators or reviewers.
+- Sections are processed concurrently, within the concurrency budget of the client.
+- Results of a SectionStore (paragraph-level sections) are collected in a compact store too.
+- Prompt prefix mode: instructions and reference material (glossary, style guide, context
+  summary) form a system prompt built once and sent byte-identical with every section, so
+  providers can serve it from their prompt cache; only the section itself varies.
+- Truncated outputs (the model hit its output limit) are re-chunked: the section is split at
+  sentence boundaries, the pieces are processed concurrently and their results stitched back
+  under the original id. The size that proved too long caps the sections of the rest of the
+  run, which are split upfront instead of being sent whole and truncated again.
 """
 
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from document_parser import DocumentParser
+from section_store import SectionStore
 from .base_processor import BaseProcessor
 
+# Sections this small are not split any further, even if their output was truncated
+MIN_RECHUNK_TOKENS = 64
+# Share of the output limit a re-chunked piece is expected to use
+RECHUNK_OUTPUT_MARGIN = 0.8
+
 class BaseOpenAIProcessor(BaseProcessor):
     def __init__(self, client, processor_parameters):
         super().__init__(client, processor_parameters)
         self.additional_prompt = processor_parameters.get('additional_prompt', '')
+        self.prompt_prefix_caching = processor_parameters.get('prompt_prefix_caching', False)
+        # (title, text) pairs of static reference material, e.g. ("Glossary", "...")
+        self.reference_material = processor_parameters.get('reference_material') or []
+        self.rechunk_truncated = processor_parameters.get('rechunk_truncated', True)
+        self._prompt_prefix = None
+        self._cache_key = None
+        # Learned from truncated outputs: longest section (in tokens) sent whole for the rest of the run
+        self._max_section_tokens = None
+        self._rechunk_lock = threading.Lock()
+        self._splitter = None
         
-    def process_sections(self, sections):
-        results = []
-        idx = 0
-        for s in sections:
-            section_id = s.get("id", idx)
-
-            # Skip API calls and return as-is for content defined by this method (default: empty or all-whitespaces)
-            if self.do_not_process(s):
-                results.append({"id": section_id, "content": s["content"]})  # Preserve ID for empty sections
-                continue
-
-            # Else call the API only for content that passes the check
-            c = self.client.get_completion(f"{self.build_prompt()}. {self.additional_prompt}", s["content"])
-            if c:
-                # Wrap the result in a dictionary with the necessary keys
-                res = {"id": section_id, "content": c}
-                results.append(res)
-        idx+=1
+    def process_sections(self, sections, on_result=None):
+        """
+        Processes sections concurrently, up to the client's concurrency budget, and returns the
+        results in the original order. Sections can be a lazy iterable: only a bounded window
+        of them is read ahead of the sections being processed. Results are collected as they
+        complete, so a slow section never holds up the others.
+
+        :param on_result: Optional callable, called as on_result(position, result) in the calling
+                          thread as each result completes.
+        """
+        workers = max(1, getattr(self.client, "max_concurrency", 1))
+        results = sections.results_store() if isinstance(sections, SectionStore) else []
+        completed = {}  # section index -> result
+        running = {}    # future -> section index
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for idx, s in enumerate(sections):
+                running[executor.submit(self.process_section, s, s.get("id", idx))] = idx
+                if len(running) >= 2 * workers:
+                    self._collect(running, completed, on_result)
+            while running:
+                self._collect(running, completed, on_result)
+        for idx in sorted(completed):
+            results.append(completed[idx])
         return results
 
+    def process_section(self, s, section_id):
+        # Skip API calls and return as-is for content defined by this method (default: empty or all-whitespaces)
+        if self.do_not_process(s):
+            return {"id": section_id, "content": s["content"], "title": s.get("title", "")}  # Preserve ID for empty sections
+
+        if self.rechunk_truncated and self._exceeds_section_limit(s["content"]):
+            pieces = self._split(s, self._max_section_tokens)
+            # A single sentence above the limit is sent whole
+            if len(pieces) > 1:
+                self._count("sections_split_before_sending")
+                return self._process_pieces(s, section_id, pieces, time.monotonic())
+
+        # Else call the API only for content that passes the check
+        details = {}
+        started = time.monotonic()
+        c = self.client.get_completion(
+            self.system_prompt(), s["content"], self.expected_output_ratio(),
+            cache_key=self.prompt_cache_key(), details=details,
+        )
+        if c and details.get("finish_reason") == "length" and self.rechunk_truncated:
+            rechunked = self._rechunk(s, section_id, details, started)
+            if rechunked is not None:
+                return rechunked
+        if c:
+            # Wrap the result in a dictionary with the necessary keys, plus what the call cost
+            return {
+                "id": section_id,
+                "content": c,
+                "title": s.get("title", ""),
+                "model": details.get("model"),
+                "prompt_tokens": details.get("prompt_tokens"),
+                "completion_tokens": details.get("completion_tokens"),
+                "latency": time.monotonic() - started,
+            }
+        return None
+
+    def _rechunk(self, s, section_id, details, started):
+        """
+        Re-processes a section whose output was truncated, in pieces, and lowers the section size
+        limit of the run. Returns None when the section can't be split any further.
+        """
+        tokens = self._splitter_parser().count_tokens(s["content"])
+        # Half the section, or what the observed output limit allows at the expected output ratio
+        limit = tokens // 2
+        completion_tokens = details.get("completion_tokens")
+        if completion_tokens:
+            limit = min(limit, int(completion_tokens * RECHUNK_OUTPUT_MARGIN / max(self.expected_output_ratio(), 0.01)))
+        limit = max(limit, MIN_RECHUNK_TOKENS)
+        pieces = self._split(s, limit) if limit < tokens else []
+        if len(pieces) < 2:
+            logging.error(f"Output of section {section_id} truncated, and it can't be split any further")
+            return None
+
+        with self._rechunk_lock:
+            if self._max_section_tokens is None or limit < self._max_section_tokens:
+                self._max_section_tokens = limit
+                self._set_metric("max_section_tokens", limit)
+        self._count("sections_rechunked_after_truncation")
+        logging.warning(f"Output of section {section_id} truncated, re-processing it in pieces of {limit} tokens")
+
+        result = self._process_pieces(s, section_id, pieces, started)
+        if result is not None:
+            # The truncated call is part of what the section cost
+            for key in ("prompt_tokens", "completion_tokens"):
+                if details.get(key) is not None and result[key] is not None:
+                    result[key] += details[key]
+        return result
+
+    def _split(self, s, max_tokens):
+        return self._splitter_parser().split_section({"title": s.get("title", ""), "content": s["content"]}, max_tokens)
+
+    def _process_pieces(self, s, section_id, pieces, started):
+        workers = min(len(pieces), max(1, getattr(self.client, "max_concurrency", 1)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda piece: self.process_section(piece, section_id), pieces))
+        if any(result is None for result in results):
+            logging.error(f"A piece of section {section_id} failed")
+            return None
+
+        content = results[0]["content"]
+        for separator, result in zip(self._separators(s["content"], pieces), results[1:]):
+            content += separator + result["content"]
+        return {
+            "id": section_id,
+            "content": content,
+            "title": s.get("title", ""),
+            "model": next((result.get("model") for result in results if result.get("model")), None),
+            "prompt_tokens": _total(results, "prompt_tokens"),
+            "completion_tokens": _total(results, "completion_tokens"),
+            "latency": time.monotonic() - started,
+        }
+
+    def _separators(self, content, pieces):
+        """
+        Line or paragraph break found between consecutive pieces in the original text, else a space
+        (nothing, for pieces cut without whitespace between them).
+        """
+        separators = []
+        end = content.find(pieces[0]["content"]) + len(pieces[0]["content"])
+        for piece in pieces[1:]:
+            start = content.find(piece["content"], end)
+            gap = content[end:start] if start >= 0 else ""
+            separators.append("\n\n" if "\n\n" in gap else "\n" if "\n" in gap else " " if gap else "")
+            end = start + len(piece["content"]) if start >= 0 else end
+        return separators
+
+    def _exceeds_section_limit(self, content):
+        limit = self._max_section_tokens
+        # A token is at least one character: shorter sections need no tokenizing
+        if limit is None or len(content) <= limit:
+            return False
+        return self._splitter_parser().count_tokens(content) > limit
+
+    def _splitter_parser(self):
+        if self._splitter is None:
+            self._splitter = DocumentParser(heading_styles=[])
+        return self._splitter
+
+    def _count(self, name, amount=1):
+        metrics = getattr(self.client, "metrics", None)
+        if metrics is not None:
+            metrics.increment(name, amount)
+
+    def _set_metric(self, name, value):
+        metrics = getattr(self.client, "metrics", None)
+        if metrics is not None:
+            metrics.set(name, value)
+
+    def _collect(self, running, completed, on_result=None):
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            idx = running.pop(future)
+            res = future.result()
+            if res is not None:
+                completed[idx] = res
+                if on_result:
+                    on_result(idx, res)
+
     # Sections matching this criteria will not be sent to OpenAI and just added as-they-are to mapping
     def do_not_process(self, section):
         return not section["content"].strip()
 
+    def system_prompt(self):
+        if self.prompt_prefix_caching:
+            if self._prompt_prefix is None:
+                self._prompt_prefix = self.build_prompt_prefix()
+            return self._prompt_prefix
+        return self._with_reference_material(f"{self.build_prompt()}. {self.additional_prompt}")
+
+    def build_prompt_prefix(self):
+        """
+        The static part of every request, built once per run: instructions first, then the
+        reference material in a fixed order, with normalised line endings and whitespace so the
+        bytes never depend on how the inputs were written.
+        """
+        instructions = f"{self.build_prompt()}. {self.additional_prompt}"
+        return self._normalise(self._with_reference_material(instructions))
+
+    def prompt_cache_key(self):
+        # Same prefix, same key: requests sharing it are routed to the same provider cache
+        if not self.prompt_prefix_caching:
+            return None
+        if self._cache_key is None:
+            self._cache_key = hashlib.sha256(self.system_prompt().encode("utf-8")).hexdigest()[:32]
+        return self._cache_key
+
+    def _with_reference_material(self, prompt):
+        blocks = [prompt]
+        for title, text in self.reference_material:
+            if text and text.strip():
+                blocks.append(f"## {title}\n{text.strip()}")
+        return "\n\n".join(blocks)
+
+    def _normalise(self, text):
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        return "\n".join(line.rstrip() for line in lines).strip()
+
     def build_prompt(self):
         return ''
 
+    # Expected output tokens per input token, used to estimate how long a section will take
+    # (scheduling order and request deadlines)
+    def expected_output_ratio(self):
+        return 1.0
+
     def output_suffix(self):
-        return "ai_processed"
\ No newline at end of file
+        return "ai_processed"
+
+def _total(results, key):
+    values = [result.get(key) for result in results]
+    return None if any(value is None for value in values) else sum(values)
@@ -12,8 +12,9 @@ class BaseProcessor:
         self.client = client
         self.processor_parameters = processor_parameters
 
-    # Override this to declare sections processing logic
-    def process_sections(self, sections):
+    # Override this to declare sections processing logic. `on_result(position, result)`, if
+    # given, receives each result as soon as it's ready
+    def process_sections(self, sections, on_result=None):
         return sections
 
     def output_suffix(self):
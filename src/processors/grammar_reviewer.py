@@ -39,6 +39,10 @@ class GrammarReviewer(BaseOpenAIProcessor):
     def output_suffix(self):
         return "reviewed"
 
+    # A fixed text is as long as the input, a report only lists the issues found
+    def expected_output_ratio(self):
+        return 1.0 if self.docx_in_docx_mode else 0.3
+
     def build_prompt(self):
         sev_map = {
             1: "very lenient",
@@ -47,4 +51,4 @@ class GrammarReviewer(BaseOpenAIProcessor):
             4: "strict",
             5: "very strict"
         }
-        return f"{self.base_prompt}\nDo it with a severity level that's {sev_map.get(self.severity, 'normal')}"
\ No newline at end of file
+        return f"{self.base_prompt}\nDo it with a severity level that's {sev_map.get(self.severity, 'normal')}"
@@ -20,7 +20,7 @@ class Reporter(BaseProcessor):
     def output_suffix(self):
         return "report"
 
-    def process_sections(self, sections):
+    def process_sections(self, sections, on_result=None):
         # Concatenate all sections into one big text
         full_text = []
         for sec in sections:
@@ -29,6 +29,8 @@ class Reporter(BaseProcessor):
         self.text = "\n\n".join(full_text)
 
         report = self.generate_report(self.text)
+        if on_result:
+            on_result(0, report)
         return [report]
 
     def generate_report(self, text):
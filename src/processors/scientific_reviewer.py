@@ -42,6 +42,10 @@ class ScientificReviewer(BaseOpenAIProcessor):
         
     def output_suffix(self):
         return "scientifically_reviewed"
+
+    # A fixed text is as long as the input, a report only lists the issues found
+    def expected_output_ratio(self):
+        return 1.0 if self.docx_in_docx_mode else 0.3
     
     def build_prompt(self):
         sev_map = {
@@ -24,6 +24,9 @@ class Summariser(BaseOpenAIProcessor):
     def output_suffix(self):
         return "summarised"
 
+    def expected_output_ratio(self):
+        return 0.25
+
     def build_prompt(self):
         return self.base_prompt
     
@@ -30,5 +30,9 @@ class Translator(BaseOpenAIProcessor):
     def output_suffix(self):
         return f"translated_{self.source_lang}_{self.target_lang}"
 
+    # Translations usually come out slightly longer than the source, in tokens
+    def expected_output_ratio(self):
+        return 1.2
+
     def build_prompt(self):
         return self.base_prompt.format(src=self.source_lang, tgt=self.target_lang)
\ No newline at end of file
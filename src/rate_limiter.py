@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""
+RateLimiter: a thread-safe token bucket shared by everything that talks to the API.
+
+- Budget is expressed in requests per minute, refilled continuously.
+- `acquire` blocks the calling thread until a request slot is available, `try_acquire` doesn't.
+- A budget of 0 (or None) disables limiting altogether.
+"""
+
+import threading
+import time
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param requests_per_minute: Maximum sustained request rate. 0 or None means unlimited.
+        :param clock: Monotonic clock, injectable for deterministic use.
+        :param sleep: Sleep function, injectable for deterministic use.
+        """
+        self.requests_per_minute = requests_per_minute or 0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._capacity = float(self.requests_per_minute)
+        self._tokens = self._capacity
+        self._last_refill = clock()
+
+    def acquire(self):
+        if not self.requests_per_minute:
+            return
+        while True:
+            with self._lock:
+                if self._take():
+                    return
+                wait = (1 - self._tokens) * 60.0 / self.requests_per_minute
+            self._sleep(wait)
+
+    def try_acquire(self):
+        """
+        Takes a request slot if one is available right now, without blocking.
+        """
+        if not self.requests_per_minute:
+            return True
+        with self._lock:
+            return self._take()
+
+    def _take(self):
+        now = self._clock()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self._capacity, self._tokens + elapsed * self.requests_per_minute / 60.0)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
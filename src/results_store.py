@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+"""
+ResultsStore: structured, indexed store of processing results, alongside the txt/docx outputs.
+
+Text outputs are made for reading, not for querying: finding every section flagged by a
+reviewer across a thousand books means re-parsing gigabytes of text. The store keeps one row
+per processed section in a SQLite database:
+
+    document, section id, position, title, processor, output suffix, model,
+    prompt tokens, completion tokens, latency, result, time
+
+- Indexed on document and on processor, e.g.
+  `SELECT document, title, result FROM results WHERE processor = 'ScientificReviewer'
+   AND result NOT LIKE '%NO SERIOUS ERRORS HERE%'`.
+- Rows are written in batched transactions as results arrive (`recorder`), or all of a
+  document's at once (`record_document`), replacing those of a previous run of the same
+  processor with the same settings (output suffix) on that document.
+- Each row records whether the results are paragraph-level (docx-in-docx mode), so stored
+  results can be exported to txt/docx later (`main.py --export-results`) without calling the
+  API again, each document the way it was processed.
+"""
+
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    document TEXT NOT NULL,
+    section_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT,
+    processor TEXT NOT NULL,
+    output_suffix TEXT NOT NULL,
+    model TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    latency_seconds REAL,
+    result TEXT,
+    paragraph_level INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_document ON results(document, processor, position);
+CREATE INDEX IF NOT EXISTS results_by_processor ON results(processor);
+"""
+
+# Columns added after the first release: (name, definition), added to older databases on open
+_ADDED_COLUMNS = (
+    ("paragraph_level", "INTEGER NOT NULL DEFAULT 0"),
+)
+
+_INSERT = ("INSERT INTO results (document, section_id, position, title, processor, output_suffix, model, "
+           "prompt_tokens, completion_tokens, latency_seconds, result, paragraph_level, created) "
+           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+class ResultsStore:
+    def __init__(self, path, batch_size=500, clock=time.time):
+        """
+        :param path: SQLite database file, created if missing.
+        :param batch_size: Rows per insert batch.
+        :param clock: Wall clock for the row timestamps.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Archivers may run in several threads (daemon jobs): one connection, serialised by the lock
+        self._conn = sqlite3.connect(path, timeout=60.0, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        for name, definition in _ADDED_COLUMNS:
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE results ADD COLUMN {name} {definition}")
+
+    def recorder(self, document, processor, output_suffix, paragraph_level=False):
+        """
+        A ResultsRecorder storing the results of `processor` on `document` as they arrive.
+        """
+        return ResultsRecorder(self, document, processor, output_suffix, paragraph_level)
+
+    def record_document(self, document, processor, output_suffix, sections, results, paragraph_level=False):
+        """
+        Replaces the stored results of `processor` (and `output_suffix`) on `document`, in one transaction.
+
+        :param sections: Parsed sections of the document, used for titles missing from results
+                         (may be an exhausted iterator, when sections were streamed).
+        :param results: Processed results: mappings with at least "content" (and usually "id", "title",
+                        "model", "prompt_tokens", "completion_tokens", "latency"), or plain strings.
+        :param paragraph_level: Results are paragraph-level (docx-in-docx mode).
+        """
+        titles = {}
+        if hasattr(sections, "__len__"):
+            titles = {section.get("id", idx): section.get("title") for idx, section in enumerate(sections)}
+
+        now = self._clock()
+        rows = [
+            self._row(document, processor, output_suffix, paragraph_level, position, result, titles, now)
+            for position, result in enumerate(results)
+        ]
+        self._write(document, processor, output_suffix, rows, replace=True)
+
+    def _row(self, document, processor, output_suffix, paragraph_level, position, result, titles, now):
+        if not isinstance(result, Mapping):
+            result = {"content": result}
+        section_id = result.get("id", position)
+        return (
+            document, str(section_id), position, result.get("title") or titles.get(section_id),
+            processor, output_suffix, result.get("model"), result.get("prompt_tokens"),
+            result.get("completion_tokens"), result.get("latency"), result["content"],
+            int(bool(paragraph_level)), now,
+        )
+
+    def _write(self, document, processor, output_suffix, rows, replace):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if replace:
+                    # The suffix tells apart runs of one processor with other settings (it->en, it->fr)
+                    self._conn.execute(
+                        "DELETE FROM results WHERE document = ? AND processor = ? AND output_suffix = ?",
+                        (document, processor, output_suffix),
+                    )
+                for start in range(0, len(rows), self.batch_size):
+                    self._conn.executemany(_INSERT, rows[start:start + self.batch_size])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def documents(self, processor=None):
+        """
+        :return: List of (document, processor, output_suffix, paragraph_level) with stored results.
+        """
+        query = "SELECT document, processor, output_suffix, MAX(paragraph_level) FROM results"
+        params = ()
+        if processor:
+            query += " WHERE processor = ?"
+            params = (processor,)
+        query += " GROUP BY document, processor, output_suffix ORDER BY document, processor, output_suffix"
+        with self._lock:
+            return [(row[0], row[1], row[2], bool(row[3])) for row in self._conn.execute(query, params)]
+
+    def results(self, document, processor, output_suffix):
+        """
+        :return: Stored results of `processor` (with the settings behind `output_suffix`) on
+                 `document`, in section order, shaped like process_sections results (id, title, content).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT section_id, title, result FROM results "
+                "WHERE document = ? AND processor = ? AND output_suffix = ? ORDER BY position",
+                (document, processor, output_suffix),
+            ).fetchall()
+        return [{"id": _section_id(section_id), "title": title, "content": result} for section_id, title, result in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ResultsRecorder:
+    """
+    Stores the results of one document as they arrive, a batch (one transaction) at a time.
+    The first batch replaces the rows of a previous run of the same processor and output suffix
+    on the document.
+    """
+    def __init__(self, store, document, processor, output_suffix, paragraph_level=False):
+        self.store = store
+        self.document = document
+        self.processor = processor
+        self.output_suffix = output_suffix
+        self.paragraph_level = paragraph_level
+        self._rows = []
+        self._replaced = False
+        self._lock = threading.Lock()
+
+    def add(self, position, result):
+        """
+        :param position: Position of the result's section in the document.
+        :param result: Result as returned by process_section, None for a failed section.
+        """
+        if result is None:
+            return
+        row = self.store._row(self.document, self.processor, self.output_suffix, self.paragraph_level,
+                              position, result, {}, self.store._clock())
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) >= self.store.batch_size:
+                self._flush()
+
+    def finish(self):
+        """
+        Stores the last, partial batch (and clears old rows of a document that produced none).
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self.store._write(self.document, self.processor, self.output_suffix, self._rows, replace=not self._replaced)
+        self._replaced = True
+        self._rows = []
+
+def _section_id(value):
+    # Ids are stored as text (they may be strings), but are integers for every built-in parser
+    return int(value) if value.lstrip("-").isdigit() else value
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+RunMetrics: thread-safe counters and gauges collected during a processing run.
+
+- Counters only grow (`increment`), gauges hold the latest value (`set`).
+- `report` renders everything as a short human readable run report.
+- LatencyTracker keeps a window of recent latencies and computes percentiles on it.
+"""
+
+import threading
+from collections import deque
+
+class RunMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def get(self, name, default=0):
+        with self._lock:
+            if name in self._gauges:
+                return self._gauges[name]
+            return self._counters.get(name, default)
+
+    def snapshot(self):
+        with self._lock:
+            return {**self._counters, **self._gauges}
+
+    def report(self):
+        lines = ["===== RUN REPORT ====="]
+        for name, value in sorted(self.snapshot().items()):
+            if isinstance(value, float):
+                value = f"{value:.2f}"
+            lines.append(f"{name.replace('_', ' ').capitalize()}: {value}")
+        return "\n".join(lines)
+
+class LatencyTracker:
+    def __init__(self, window=1000):
+        """
+        :param window: Number of most recent latencies percentiles are computed on.
+        """
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def count(self):
+        with self._lock:
+            return len(self._latencies)
+
+    def percentile(self, q):
+        """
+        :param q: Percentile as a fraction, e.g. 0.95. None if nothing was recorded yet.
+        """
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""
+SectionCache: on-disk cache of parsed document sections.
+
+- Entries are keyed by the file content hash plus every parser setting that affects the
+  output (parser version, heading styles, word threshold, max tokens, docx-in-docx mode),
+  so a changed file or setting simply misses the cache.
+- Entries are stored in a compact binary format: marshal-serialised sections, zlib-compressed,
+  behind a small header carrying the format and marshal versions. A SectionStore is
+  serialised through its array state.
+- The cache is bounded in size: least recently used entries are evicted first.
+"""
+
+import hashlib
+import json
+import logging
+import marshal
+import os
+import zlib
+from file_utils import ensure_directory, hash_file
+from section_store import SectionStore
+
+_MAGIC = b"KSC1"
+_HEADER = _MAGIC + bytes([marshal.version])
+_SUFFIX = ".sections"
+
+class SectionCache:
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        """
+        :param cache_dir: Directory holding the cache entries.
+        :param max_bytes: Total size above which least recently used entries are evicted.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        ensure_directory(cache_dir)
+
+    def key(self, file_path, settings):
+        """
+        :param settings: JSON-serialisable parser settings affecting the parsed output.
+        """
+        material = json.dumps([hash_file(file_path), settings], sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if not data.startswith(_HEADER):
+            return None
+        try:
+            sections = marshal.loads(zlib.decompress(data[len(_HEADER):]))
+            if isinstance(sections, dict):
+                sections = SectionStore.from_state(sections["section_store"])
+        except (ValueError, EOFError, TypeError, KeyError, zlib.error) as e:
+            logging.warning(f"Dropping corrupted section cache entry {path}: {e}")
+            self._remove(path)
+            return None
+        os.utime(path)  # Mark as recently used for eviction
+        return sections
+
+    def put(self, key, sections):
+        path = self._path(key)
+        if isinstance(sections, SectionStore):
+            sections = {"section_store": sections.to_state()}
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER)
+            f.write(zlib.compress(marshal.dumps(sections), 6))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(_SUFFIX):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + _SUFFIX)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
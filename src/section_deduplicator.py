@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+SectionDeduplicator: sends every distinct section of a run to the processor only once.
+
+Manuscripts of the same series share front matter, author bios, disclaimers, exercise
+templates and so on. Sections are keyed by a hash of their normalised content (Unicode
+NFC, collapsed whitespace) across all documents of the run; each unique section is
+processed once and its result is fanned out to every occurrence, which keeps its own id.
+
+Only applies to processors that handle sections independently (BaseOpenAIProcessor).
+"""
+
+import hashlib
+import re
+import unicodedata
+from processors.base_openai_processor import BaseOpenAIProcessor
+
+_WHITESPACE = re.compile(r"\s+")
+
+def section_key(content):
+    normalised = _WHITESPACE.sub(" ", unicodedata.normalize("NFC", content)).strip()
+    return hashlib.sha256(normalised.encode("utf-8")).hexdigest()
+
+class SectionDeduplicator:
+    def __init__(self, processor, metrics=None, process_sections=None):
+        """
+        :param processor: Processor handling the unique sections.
+        :param metrics: Optional RunMetrics, receives the deduplication counters.
+        :param process_sections: Optional callable processing the list of unique sections
+                                 (e.g. a SectionScheduler), defaults to processor.process_sections.
+        """
+        self.processor = processor
+        self.metrics = metrics
+        self.process_sections = process_sections or processor.process_sections
+
+    @staticmethod
+    def supports(processor):
+        return isinstance(processor, BaseOpenAIProcessor)
+
+    def process(self, sections_by_document, on_result=None):
+        """
+        :param sections_by_document: List of parsed sections, one list per document.
+        :param on_result: Optional callable, called as on_result(doc_index, position, result) for
+                          every occurrence as soon as its unique section's result is ready.
+        :return: List of results, one list per document, as process_sections would return them.
+        """
+        unique_sections = []
+        unique_index_by_key = {}
+        occurrences_by_unique = []  # unique index -> [(doc_index, position, section_id, title)]
+        plans = []
+        occurrences = 0
+
+        for doc_index, sections in enumerate(sections_by_document):
+            plan = []
+            for idx, section in enumerate(sections):
+                section_id = section.get("id", idx)
+                title = section.get("title", "")
+                if self.processor.do_not_process(section):
+                    result = {"id": section_id, "content": section["content"], "title": title}
+                    plan.append((section_id, None, result))
+                    if on_result:
+                        on_result(doc_index, idx, result)
+                    continue
+
+                key = section_key(section["content"])
+                unique_index = unique_index_by_key.get(key)
+                if unique_index is None:
+                    unique_index = len(unique_sections)
+                    unique_index_by_key[key] = unique_index
+                    unique_sections.append({
+                        "id": unique_index,
+                        "title": title,
+                        "content": section["content"],
+                    })
+                    occurrences_by_unique.append([])
+                occurrences_by_unique[unique_index].append((doc_index, idx, section_id, title))
+                plan.append((section_id, unique_index, title))
+                occurrences += 1
+            plans.append(plan)
+
+        def fan_out(unique_index, unique_result):
+            for n, (doc_index, idx, section_id, title) in enumerate(occurrences_by_unique[unique_index]):
+                on_result(doc_index, idx, self._occurrence(unique_result, section_id, title, first=n == 0))
+
+        unique_results = {
+            r["id"]: r for r in self.process_sections(unique_sections, on_result=fan_out if on_result else None)
+        }
+
+        if self.metrics is not None:
+            self.metrics.increment("sections_to_process", occurrences)
+            self.metrics.increment("unique_sections", len(unique_sections))
+            self.metrics.increment("api_calls_saved_by_deduplication", occurrences - len(unique_sections))
+
+        results_by_document = []
+        for doc_index, plan in enumerate(plans):
+            results = []
+            for idx, (section_id, unique_index, entry) in enumerate(plan):
+                if unique_index is None:
+                    results.append(entry)
+                    continue
+                unique_result = unique_results.get(unique_index)
+                if unique_result is None:
+                    continue  # Failed call: skipped, as process_sections does
+                first = occurrences_by_unique[unique_index][0][:2] == (doc_index, idx)
+                results.append(self._occurrence(unique_result, section_id, entry, first))
+            results_by_document.append(results)
+        return results_by_document
+
+    def _occurrence(self, unique_result, section_id, title, first):
+        """
+        Result of one occurrence of a unique section. The model is kept everywhere, but tokens
+        and latency only on the first occurrence: the call was paid for once.
+        """
+        result = dict(unique_result, id=section_id, title=title)
+        if not first:
+            for key in ("prompt_tokens", "completion_tokens", "latency"):
+                result[key] = None
+        return result
+
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+SectionScheduler: makespan-aware dispatch of the sections of a whole batch of documents.
+
+With parallel execution, a single big chapter started last decides the total wall time.
+The scheduler pools the sections of all documents, estimates each section's cost and
+dispatches the most expensive ones first (LPT, longest processing time first), which keeps
+the batch completion time close to its lower bound: max(total work / workers, longest section).
+
+- Cost estimate: output tokens dominate latency, so a section costs its expected output
+  tokens (content tokens * processor.expected_output_ratio()) plus its prompt tokens
+  (system prompt + content) weighted by PROMPT_TOKEN_WEIGHT.
+- Priorities: documents matching earlier `--priority` glob patterns are dispatched before
+  the others, largest first within the same priority.
+- Results are reassembled in the original section order, and each document is handed back
+  as soon as all of its sections are done.
+"""
+
+import fnmatch
+import os
+import time
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from document_parser import get_encoding
+from processors.base_openai_processor import BaseOpenAIProcessor
+
+# Prompt tokens are processed much faster than output tokens are generated
+PROMPT_TOKEN_WEIGHT = 0.1
+
+def document_priority(doc_path, patterns):
+    """
+    Rank of the first glob pattern matching the document path (or its file name);
+    documents matching no pattern come last.
+    """
+    patterns = patterns or []
+    name = os.path.basename(doc_path)
+    for rank, pattern in enumerate(patterns):
+        if fnmatch.fnmatch(doc_path, pattern) or fnmatch.fnmatch(name, pattern):
+            return rank
+    return len(patterns)
+
+class SectionScheduler:
+    def __init__(self, processor, workers=None, metrics=None):
+        """
+        :param processor: Processor handling each section (BaseOpenAIProcessor).
+        :param workers: Parallel sections, defaults to the client's concurrency budget.
+        :param metrics: Optional RunMetrics receiving the schedule statistics.
+        """
+        self.processor = processor
+        self.workers = workers or max(1, getattr(processor.client, "max_concurrency", 1))
+        self.metrics = metrics
+
+    @staticmethod
+    def supports(processor):
+        return isinstance(processor, BaseOpenAIProcessor)
+
+    def estimate_cost(self, section, prompt_tokens):
+        content_tokens = len(get_encoding().encode(section["content"]))
+        expected_output = content_tokens * self.processor.expected_output_ratio()
+        return expected_output + (prompt_tokens + content_tokens) * PROMPT_TOKEN_WEIGHT
+
+    def process_sections(self, sections, on_result=None):
+        """
+        Drop-in replacement for processor.process_sections, with largest-first dispatch.
+        """
+        report = (lambda doc_index, idx, result: on_result(idx, result)) if on_result else None
+        return self.run([sections], on_result=report)[0]
+
+    def run(self, sections_by_document, priorities=None, on_document_done=None, on_result=None):
+        """
+        :param sections_by_document: List of parsed sections, one list per document.
+        :param priorities: Optional priority per document, lower goes first.
+        :param on_document_done: Called as on_document_done(doc_index, results) once a
+                                 document's sections are all processed.
+        :param on_result: Called as on_result(doc_index, position, result) as each result
+                          completes (None results of failed sections aren't reported).
+        :return: List of results, one list per document, in original section order.
+        """
+        sections_by_document = [
+            sections if isinstance(sections, Sequence) else list(sections)
+            for sections in sections_by_document
+        ]
+        priorities = priorities or [0] * len(sections_by_document)
+        results = [[None] * len(sections) for sections in sections_by_document]
+        remaining = [len(sections) for sections in sections_by_document]
+        prompt_tokens = len(get_encoding().encode(self.processor.system_prompt()))
+
+        tasks = []
+        for doc_index, sections in enumerate(sections_by_document):
+            for idx, section in enumerate(sections):
+                section_id = section.get("id", idx)
+                if self.processor.do_not_process(section):
+                    results[doc_index][idx] = self.processor.process_section(section, section_id)
+                    remaining[doc_index] -= 1
+                    if on_result:
+                        on_result(doc_index, idx, results[doc_index][idx])
+                    continue
+                cost = self.estimate_cost(section, prompt_tokens)
+                tasks.append((priorities[doc_index], -cost, doc_index, idx, section_id))
+        tasks.sort(key=lambda task: task[:2])  # Stable: ties keep the original order
+
+        for doc_index, left in enumerate(remaining):
+            if left == 0 and on_document_done:
+                on_document_done(doc_index, self._ordered(results[doc_index]))
+
+        started = time.monotonic()
+        durations = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # The executor queue is FIFO, so submission order is dispatch order
+            futures = {
+                executor.submit(self._timed, sections_by_document[doc_index][idx], section_id): (doc_index, idx)
+                for _, _, doc_index, idx, section_id in tasks
+            }
+            for future in as_completed(futures):
+                doc_index, idx = futures[future]
+                result, duration = future.result()
+                results[doc_index][idx] = result
+                durations.append(duration)
+                remaining[doc_index] -= 1
+                if on_result and result is not None:
+                    on_result(doc_index, idx, result)
+                if remaining[doc_index] == 0 and on_document_done:
+                    on_document_done(doc_index, self._ordered(results[doc_index]))
+
+        self._record(time.monotonic() - started, durations)
+        return [self._ordered(document_results) for document_results in results]
+
+    def _timed(self, section, section_id):
+        started = time.monotonic()
+        result = self.processor.process_section(section, section_id)
+        return result, time.monotonic() - started
+
+    def _ordered(self, document_results):
+        return [r for r in document_results if r is not None]
+
+    def _record(self, wall_time, durations):
+        if self.metrics is None or not durations:
+            return
+        lower_bound = max(sum(durations) / self.workers, max(durations))
+        self.metrics.increment("scheduled_sections", len(durations))
+        self.metrics.set("schedule_wall_seconds", wall_time)
+        self.metrics.set("schedule_lower_bound_seconds", lower_bound)
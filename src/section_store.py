@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""
+SectionStore: compact storage for the many small sections of paragraph-level processing.
+
+In docx-in-docx mode every paragraph, header and footer line is a section, and books easily
+reach 100k of them: one dict (plus id and title strings) per paragraph costs far more than
+the text itself. The store keeps them in parallel arrays instead:
+
+- All contents live in one text buffer, each section is a pair of offsets into it.
+- Ids are integers (the paragraph position in document order), the part of the document a
+  section comes from is a SectionKind, and titles ("Paragraph 3", "Header 1") are derived.
+- Style names are interned in a small table, sections only hold an index into it.
+- Indexing the store returns a SectionView, a read-only dict-compatible view, so processors
+  written for plain dict sections (`s["content"]`, `s.get("id", idx)`) keep working.
+- Processor results can be collected in a store too (`results_store`), which also keeps what
+  each call cost (model, tokens, latency), and the store can be turned into marshal-friendly
+  state for the section cache.
+"""
+
+from array import array
+from collections.abc import Mapping, Sequence
+from enum import IntEnum
+
+class SectionKind(IntEnum):
+    MAIN = 0
+    HEADER = 1
+    FOOTER = 2
+
+_TITLE_PREFIXES = {
+    SectionKind.MAIN: "Paragraph",
+    SectionKind.HEADER: "Header",
+    SectionKind.FOOTER: "Footer",
+}
+
+_VIEW_KEYS = ("id", "title", "content", "style_name")
+_RESULT_KEYS = _VIEW_KEYS + ("model", "prompt_tokens", "completion_tokens", "latency")
+
+class SectionStore(Sequence):
+    def __init__(self, source=None):
+        """
+        :param source: Optional store the sections of this one derive from (processor results):
+                       appended sections without a kind take kind and position from the
+                       source section with the same id.
+        """
+        self.source = source
+        self._ids = array('q')
+        self._kinds = array('B')
+        self._ordinals = array('I')
+        self._style_indexes = array('H')
+        self._offsets = array('Q', [0])
+        self._styles = [None]
+        self._style_index_by_name = {None: 0}
+        self._buffer = ""
+        self._pending = []
+        # Results only: call costs, -1 / NaN when unknown, models interned like style names
+        self._call_costs = None
+        if source is not None:
+            self._call_costs = (array('l'), array('l'), array('d'), array('H'))
+            self._models = [None]
+            self._model_index_by_name = {None: 0}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("section index out of range")
+        return SectionView(self, index)
+
+    def add(self, content, kind=SectionKind.MAIN, ordinal=0, style_name=None, section_id=None):
+        """
+        Appends a section, returns its id (its position unless given).
+        """
+        if section_id is None:
+            section_id = len(self._ids)
+        style_index = self._style_index_by_name.get(style_name)
+        if style_index is None:
+            style_index = len(self._styles)
+            self._styles.append(style_name)
+            self._style_index_by_name[style_name] = style_index
+
+        self._pending.append(content)
+        self._ids.append(section_id)
+        self._kinds.append(kind)
+        self._ordinals.append(ordinal)
+        self._style_indexes.append(style_index)
+        self._offsets.append(self._offsets[-1] + len(content))
+        return section_id
+
+    def append(self, section):
+        """
+        Appends a dict-like section (e.g. a processor result {"id": ..., "content": ...}).
+        """
+        section_id = section.get("id")
+        kind = section.get("kind")
+        ordinal = section.get("ordinal")
+        if kind is None and self.source is not None and section_id is not None:
+            original = self.source[section_id]
+            kind, ordinal = original.kind, original.ordinal
+        self.add(
+            section["content"],
+            kind=SectionKind.MAIN if kind is None else kind,
+            ordinal=ordinal or 0,
+            style_name=section.get("style_name"),
+            section_id=section_id,
+        )
+        if self._call_costs is not None:
+            prompt_tokens, completion_tokens, latencies, models = self._call_costs
+            prompt_tokens.append(_or(section.get("prompt_tokens"), -1))
+            completion_tokens.append(_or(section.get("completion_tokens"), -1))
+            latencies.append(_or(section.get("latency"), float("nan")))
+            model = section.get("model")
+            model_index = self._model_index_by_name.get(model)
+            if model_index is None:
+                model_index = len(self._models)
+                self._models.append(model)
+                self._model_index_by_name[model] = model_index
+            models.append(model_index)
+
+    def results_store(self):
+        """
+        An empty store for the processed results of this one.
+        """
+        return SectionStore(source=self)
+
+    def content(self, index):
+        buffer = self._text()
+        return buffer[self._offsets[index]:self._offsets[index + 1]]
+
+    def section_id(self, index):
+        return self._ids[index]
+
+    def kind(self, index):
+        return SectionKind(self._kinds[index])
+
+    def ordinal(self, index):
+        return self._ordinals[index]
+
+    def style_name(self, index):
+        return self._styles[self._style_indexes[index]]
+
+    def call_cost(self, key, index):
+        """
+        Model, prompt_tokens, completion_tokens or latency of a result, None when unknown.
+        """
+        if self._call_costs is None:
+            return None
+        prompt_tokens, completion_tokens, latencies, models = self._call_costs
+        if key == "model":
+            return self._models[models[index]]
+        value = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "latency": latencies}[key][index]
+        return None if value == -1 or value != value else value
+
+    def keys_of_views(self):
+        return _RESULT_KEYS if self._call_costs is not None else _VIEW_KEYS
+
+    def title(self, index):
+        return f"{_TITLE_PREFIXES[self.kind(index)]} {self._ordinals[index] + 1}"
+
+    def _text(self):
+        if self._pending:
+            self._buffer += "".join(self._pending)
+            self._pending = []
+        return self._buffer
+
+    def to_state(self):
+        """
+        Plain tuple of str/bytes/tuples, serialisable with marshal.
+        """
+        return (
+            self._text(),
+            self._ids.tobytes(),
+            self._kinds.tobytes(),
+            self._ordinals.tobytes(),
+            self._style_indexes.tobytes(),
+            self._offsets.tobytes(),
+            tuple(self._styles),
+        )
+
+    @classmethod
+    def from_state(cls, state):
+        buffer, ids, kinds, ordinals, style_indexes, offsets, styles = state
+        store = cls()
+        store._buffer = buffer
+        store._ids.frombytes(ids)
+        store._kinds.frombytes(kinds)
+        store._ordinals.frombytes(ordinals)
+        store._style_indexes.frombytes(style_indexes)
+        store._offsets = array('Q')
+        store._offsets.frombytes(offsets)
+        store._styles = list(styles)
+        store._style_index_by_name = {name: i for i, name in enumerate(store._styles)}
+        return store
+
+def _or(value, default):
+    return default if value is None else value
+
+class SectionView(Mapping):
+    """
+    Read-only dict view of one section of a SectionStore, with the keys of a parsed
+    section dict: id, title, content and style_name (plus the call costs, for results).
+    """
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, key):
+        if key == "content":
+            return self._store.content(self._index)
+        if key == "id":
+            return self._store.section_id(self._index)
+        if key == "title":
+            return self._store.title(self._index)
+        if key == "style_name":
+            return self._store.style_name(self._index)
+        if key in _RESULT_KEYS and key in self._store.keys_of_views():
+            return self._store.call_cost(key, self._index)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._store.keys_of_views())
+
+    def __len__(self):
+        return len(self._store.keys_of_views())
+
+    @property
+    def kind(self):
+        return self._store.kind(self._index)
+
+    @property
+    def ordinal(self):
+        return self._store.ordinal(self._index)
+
+    def __repr__(self):
+        return repr(dict(self))
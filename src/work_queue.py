@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+"""
+WorkQueue: a shared queue of section tasks in a SQLite database, for distributed runs.
+
+The database can sit on a volume shared by several hosts: a coordinator enqueues the
+sections of every document, any number of workers claim them, and the coordinator archives
+each document once all of its sections are done.
+
+- Runs: the processor name and parameters of a batch, so workers know what to do with its tasks.
+- Documents: one row per document of a run, archived once none of its tasks is left open.
+- Tasks: one row per section, `pending` -> `leased` -> `done` (or `failed` after `max_attempts`).
+- Leases: a claimed task belongs to its worker until `lease_expires`; workers extend the lease
+  with heartbeats while they work on it. A task whose lease expired (worker crashed, host lost)
+  is claimed again by the next worker, and a late result from the old owner is discarded.
+- Every state change is a short transaction (BEGIN IMMEDIATE), with a busy timeout so
+  concurrent workers queue up on the database lock instead of failing.
+- Results keep what each call cost (model, tokens, latency), for the results store.
+- The database outlives its runs: "drained" can be scoped to the runs from a given id on, so a
+  worker started before the next batch is enqueued doesn't mistake old runs for its work.
+
+Lease times use the wall clock: hosts sharing a queue need synchronised clocks (NTP).
+"""
+
+import json
+import sqlite3
+from collections.abc import Mapping
+import threading
+import time
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    settings TEXT NOT NULL,
+    closed INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    path TEXT NOT NULL,
+    archived INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id),
+    position INTEGER NOT NULL,
+    section_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    model TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    latency_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_by_state ON tasks(state, lease_expires);
+CREATE INDEX IF NOT EXISTS tasks_by_document ON tasks(document_id, state);
+"""
+
+# Columns added to tasks after the first release: (name, type), added to older databases on open
+_TASK_COST_COLUMNS = (
+    ("model", "TEXT"),
+    ("prompt_tokens", "INTEGER"),
+    ("completion_tokens", "INTEGER"),
+    ("latency_seconds", "REAL"),
+)
+
+class WorkQueue:
+    def __init__(self, path, lease_seconds=60.0, max_attempts=3, clock=time.time):
+        """
+        :param path: SQLite database file, created if missing.
+        :param lease_seconds: How long a claimed task stays with its worker without a heartbeat.
+        :param max_attempts: Claims of a task before it's marked failed.
+        :param clock: Wall clock, injectable for deterministic use.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(_SCHEMA)
+        existing = {row["name"] for row in conn.execute("PRAGMA table_info(tasks)")}
+        for name, column_type in _TASK_COST_COLUMNS:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE tasks ADD COLUMN {name} {column_type}")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads: one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def create_run(self, settings):
+        """
+        :param settings: JSON-serialisable processor settings shared by the run's tasks.
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (settings, created) VALUES (?, ?)", (json.dumps(settings), self._clock())
+            )
+            return cursor.lastrowid
+
+    def close_run(self, run_id):
+        """
+        Marks a run as fully enqueued: once its tasks are done, workers may stop.
+        """
+        with self._transaction() as conn:
+            conn.execute("UPDATE runs SET closed = 1 WHERE id = ?", (run_id,))
+
+    def run_settings(self, run_id):
+        row = self._connection().execute("SELECT settings FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return json.loads(row["settings"])
+
+    def add_document(self, run_id, path, sections, resolve=None):
+        """
+        Enqueues a document and one task per section, in a single transaction.
+
+        :param resolve: Optional callable returning the result of a section that needs no
+                        worker (e.g. empty sections), or None to enqueue it.
+        :return: Document id.
+        """
+        with self._transaction() as conn:
+            document_id = conn.execute(
+                "INSERT INTO documents (run_id, path) VALUES (?, ?)", (run_id, path)
+            ).lastrowid
+            rows = []
+            for position, section in enumerate(sections):
+                result = resolve(section) if resolve else None
+                rows.append((
+                    document_id, position, section.get("id", position), section.get("title") or "",
+                    section["content"], DONE if result is not None else PENDING, result,
+                ))
+            conn.executemany(
+                "INSERT INTO tasks (document_id, position, section_id, title, content, state, result) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            return document_id
+
+    def claim(self, owner, limit):
+        """
+        Leases up to `limit` tasks to `owner`: pending ones, or ones whose lease expired.
+
+        :return: List of task dicts (id, run_id, section_id, title, content, attempts).
+        """
+        now = self._clock()
+        with self._transaction() as conn:
+            self._fail_exhausted(conn, now)
+            rows = conn.execute(
+                "SELECT t.id, d.run_id, t.section_id, t.title, t.content, t.attempts, t.state "
+                "FROM tasks t JOIN documents d ON d.id = t.document_id "
+                "WHERE t.state = ? OR (t.state = ? AND t.lease_expires < ?) "
+                "ORDER BY t.id LIMIT ?",
+                (PENDING, LEASED, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                [(LEASED, owner, now + self.lease_seconds, row["id"]) for row in rows],
+            )
+        return [
+            {"id": row["id"], "run_id": row["run_id"], "section_id": row["section_id"], "title": row["title"],
+             "content": row["content"], "attempts": row["attempts"] + 1, "requeued": row["state"] == LEASED}
+            for row in rows
+        ]
+
+    def _fail_exhausted(self, conn, now):
+        # Expired leases of tasks already claimed max_attempts times: give up on them
+        conn.execute(
+            "UPDATE tasks SET state = ?, owner = NULL WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, LEASED, now, self.max_attempts),
+        )
+
+    def heartbeat(self, owner, task_ids):
+        """
+        Extends the leases `owner` still holds. Returns the number of leases extended.
+        """
+        if not task_ids:
+            return 0
+        with self._transaction() as conn:
+            placeholders = ",".join("?" * len(task_ids))
+            cursor = conn.execute(
+                f"UPDATE tasks SET lease_expires = ? WHERE owner = ? AND state = ? AND id IN ({placeholders})",
+                (self._clock() + self.lease_seconds, owner, LEASED, *task_ids),
+            )
+            return cursor.rowcount
+
+    def complete(self, owner, results):
+        """
+        Stores results of tasks leased by `owner`, in one transaction.
+
+        :param results: List of (task_id, result), where result is a process_section result
+                        (content, plus model, prompt_tokens, completion_tokens, latency when
+                        known) or a plain string; a None result is a failed attempt, retried
+                        until max_attempts.
+        :return: Number of results accepted (a task re-leased to another worker is not).
+        """
+        accepted = 0
+        with self._transaction() as conn:
+            for task_id, result in results:
+                if result is not None:
+                    if not isinstance(result, Mapping):
+                        result = {"content": result}
+                    cursor = conn.execute(
+                        "UPDATE tasks SET state = ?, result = ?, model = ?, prompt_tokens = ?, completion_tokens = ?, "
+                        "latency_seconds = ?, owner = NULL, lease_expires = NULL "
+                        "WHERE id = ? AND owner = ? AND state = ?",
+                        (DONE, result["content"], result.get("model"), result.get("prompt_tokens"),
+                         result.get("completion_tokens"), result.get("latency"), task_id, owner, LEASED),
+                    )
+                else:
+                    cursor = conn.execute(
+                        "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                        "owner = NULL, lease_expires = NULL WHERE id = ? AND owner = ? AND state = ?",
+                        (self.max_attempts, FAILED, PENDING, task_id, owner, LEASED),
+                    )
+                accepted += cursor.rowcount
+        return accepted
+
+    def finished_documents(self, run_id=None):
+        """
+        Documents not archived yet whose tasks are all done or failed: list of (id, run_id, path).
+
+        :param run_id: Only the documents of this run.
+        """
+        query = ("SELECT d.id, d.run_id, d.path FROM documents d WHERE d.archived = 0 AND NOT EXISTS ("
+                 "SELECT 1 FROM tasks t WHERE t.document_id = d.id AND t.state IN (?, ?))")
+        params = [PENDING, LEASED]
+        if run_id is not None:
+            query += " AND d.run_id = ?"
+            params.append(run_id)
+        rows = self._connection().execute(query + " ORDER BY d.id", params).fetchall()
+        return [(row["id"], row["run_id"], row["path"]) for row in rows]
+
+    def document_results(self, document_id):
+        """
+        :return: (sections, results) of a document, in section order, as process_sections would
+                 see and return them (failed sections have no result).
+        """
+        rows = self._connection().execute(
+            "SELECT section_id, title, content, state, result, model, prompt_tokens, completion_tokens, "
+            "latency_seconds FROM tasks WHERE document_id = ? ORDER BY position",
+            (document_id,),
+        ).fetchall()
+        sections = [{"id": row["section_id"], "title": row["title"], "content": row["content"]} for row in rows]
+        results = [
+            {"id": row["section_id"], "title": row["title"], "content": row["result"], "model": row["model"],
+             "prompt_tokens": row["prompt_tokens"], "completion_tokens": row["completion_tokens"],
+             "latency": row["latency_seconds"]}
+            for row in rows if row["state"] == DONE
+        ]
+        return sections, results
+
+    def mark_archived(self, document_id):
+        with self._transaction() as conn:
+            conn.execute("UPDATE documents SET archived = 1 WHERE id = ?", (document_id,))
+
+    def first_active_run(self):
+        """
+        Id of the oldest run still open or with tasks left, else the id the next run will get:
+        the runs from there on are the ones a newly started worker is there for.
+        """
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT MIN(r.id) FROM runs r WHERE r.closed = 0 OR EXISTS ("
+            "SELECT 1 FROM documents d JOIN tasks t ON t.document_id = d.id "
+            "WHERE d.run_id = r.id AND t.state IN (?, ?))",
+            (PENDING, LEASED),
+        ).fetchone()
+        if row[0] is not None:
+            return row[0]
+        return conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM runs").fetchone()[0]
+
+    def is_drained(self, since_run=None):
+        """
+        True once at least one run exists, every run is closed and no task is left to work on.
+
+        :param since_run: Only consider the runs with this id or a later one.
+        """
+        since_run = since_run or 0
+        conn = self._connection()
+        runs = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(closed), 0) FROM runs WHERE id >= ?", (since_run,)
+        ).fetchone()
+        if runs[0] == 0 or runs[1] < runs[0]:
+            return False
+        open_task = conn.execute(
+            "SELECT 1 FROM tasks t JOIN documents d ON d.id = t.document_id "
+            "WHERE d.run_id >= ? AND t.state IN (?, ?) LIMIT 1",
+            (since_run, PENDING, LEASED),
+        ).fetchone()
+        return open_task is None
+
+    def run_finished(self, run_id):
+        """
+        True once the run is closed and none of its tasks is left to work on.
+        """
+        conn = self._connection()
+        run = conn.execute("SELECT closed FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if run is None or not run["closed"]:
+            return False
+        open_task = conn.execute(
+            "SELECT 1 FROM tasks t JOIN documents d ON d.id = t.document_id "
+            "WHERE d.run_id = ? AND t.state IN (?, ?) LIMIT 1",
+            (run_id, PENDING, LEASED),
+        ).fetchone()
+        return open_task is None
+
+    def counts(self):
+        rows = self._connection().execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT, rolled back on error: takes the write lock upfront, so two
+    workers can't both read the same pending tasks before either updates them.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+"""
+WorkerDaemon: a long-running worker consuming processing jobs from a directory spool.
+
+Running main.py once per job pays interpreter startup, config parsing, tokenizer loading
+and connection setup every time. The daemon pays them once and keeps them warm:
+
+- One shared OpenAIClient (keep-alive connection pool, shared concurrency and rate budget).
+- Tokenizer loaded at startup, processor classes imported once.
+- Several jobs run at once, all drawing from the same client budget.
+
+Spool layout (created on startup):
+
+    <spool>/incoming/    jobs waiting to be picked up (*.json)
+    <spool>/processing/  jobs currently running (their mtime is refreshed while they run)
+    <spool>/done/        finished jobs
+    <spool>/failed/      failed jobs, with the error stored under "error" (and the content of
+                         a job that isn't valid JSON under "job")
+
+A job is a JSON object using the same names as the CLI arguments, e.g.
+{"input_dir": "...", "processor": "Translator", "source_lang": "it", "target_lang": "en"}.
+"input_dir" may also point to a single document. Jobs are claimed with an atomic rename,
+so several daemons can safely share a spool. A job left in processing/ by a daemon that
+crashed (not refreshed for `stale_job_seconds`) goes back to incoming/, and to failed/ once
+it was recovered `max_recoveries` times (e.g. a job that keeps crashing the daemon).
+"""
+
+import copy
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from file_utils import ensure_directory, find_documents
+from document_archiver import DocumentArchiver
+from document_parser import get_encoding
+from run_metrics import RunMetrics
+from pipeline import (
+    apply_overrides,
+    load_processor_class,
+    create_client,
+    create_parser,
+    create_results_store,
+    resolve_docx_in_docx_mode,
+    build_processor_parameters,
+    process_document,
+)
+
+# Job parameters a client is allowed to set; everything else (e.g. api keys) stays in the daemon config
+JOB_KEYS = (
+    "input_dir", "output_dir", "heading_styles", "prompt", "additional_prompt", "processor",
+    "severity", "source_lang", "target_lang", "output_format", "add_section_title",
+)
+
+SPOOL_STATES = ("incoming", "processing", "done", "failed")
+
+def submit_job(spool_dir, values):
+    """
+    Writes a job into the spool atomically and returns its path.
+    """
+    job = {key: values[key] for key in JOB_KEYS if values.get(key) is not None}
+    for key in ("input_dir", "output_dir"):
+        if key in job:
+            job[key] = os.path.abspath(job[key])
+
+    incoming = os.path.join(spool_dir, "incoming")
+    ensure_directory(incoming)
+    name = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.json"
+    tmp_path = os.path.join(spool_dir, f".{name}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f)
+    job_path = os.path.join(incoming, name)
+    os.replace(tmp_path, job_path)
+    return job_path
+
+class WorkerDaemon:
+    def __init__(self, config):
+        """
+        :param config: Base ConfigManager. Each job gets its own copy with the job overrides applied.
+        """
+        self.config = config
+        self.spool_dir = config.get("daemon.spool_directory", "./spool")
+        self.max_parallel_jobs = config.get("daemon.max_parallel_jobs", 4)
+        self.poll_interval = config.get("daemon.poll_interval", 1.0)
+        self.stale_job_seconds = config.get("daemon.stale_job_seconds", 60)
+        self.max_recoveries = config.get("daemon.max_recoveries", 3)
+        self._stop = threading.Event()
+        self._processor_classes = {}
+        self._processor_classes_lock = threading.Lock()
+
+        for state in SPOOL_STATES:
+            ensure_directory(os.path.join(self.spool_dir, state))
+
+        # Warm everything that is shared between jobs
+        self.metrics = RunMetrics()
+        self.client = create_client(config, self.metrics)
+        get_encoding()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        signal.signal(signal.SIGINT, lambda *_: self.stop())
+        logging.info(f"Worker daemon started, spool: {self.spool_dir}, parallel jobs: {self.max_parallel_jobs}")
+
+        in_flight = {}  # future -> job path
+        with ThreadPoolExecutor(max_workers=self.max_parallel_jobs) as executor:
+            while not self._stop.is_set():
+                in_flight = {f: path for f, path in in_flight.items() if not f.done()}
+                self._heartbeat(in_flight.values())
+                self._recover_stale_jobs(set(in_flight.values()))
+                free_slots = self.max_parallel_jobs - len(in_flight)
+                for job_path in self._claim_jobs(free_slots):
+                    in_flight[executor.submit(self._run_job, job_path)] = job_path
+                self._stop.wait(self.poll_interval)
+            logging.info("Worker daemon stopping, waiting for running jobs to finish")
+
+        self.client.close()
+        logging.info(self.metrics.report())
+
+    def stop(self):
+        self._stop.set()
+
+    def _claim_jobs(self, limit):
+        if limit <= 0:
+            return []
+        incoming = os.path.join(self.spool_dir, "incoming")
+        try:
+            names = sorted(n for n in os.listdir(incoming) if n.endswith(".json"))
+        except FileNotFoundError:
+            return []
+
+        claimed = []
+        for name in names:
+            if len(claimed) >= limit:
+                break
+            target = os.path.join(self.spool_dir, "processing", name)
+            try:
+                os.rename(os.path.join(incoming, name), target)
+                os.utime(target)  # The rename keeps the submission mtime
+            except FileNotFoundError:
+                continue  # Claimed by another daemon in the meantime
+            claimed.append(target)
+        return claimed
+
+    def _heartbeat(self, job_paths):
+        for job_path in job_paths:
+            try:
+                os.utime(job_path)
+            except FileNotFoundError:
+                pass  # Just finished
+
+    def _recover_stale_jobs(self, running):
+        """
+        Moves jobs of crashed daemons from processing/ back to incoming/ (or to failed/).
+
+        :param running: Paths of the jobs this daemon is running.
+        """
+        processing = os.path.join(self.spool_dir, "processing")
+        now = time.time()
+        for name in os.listdir(processing):
+            job_path = os.path.join(processing, name)
+            if not name.endswith(".json") or job_path in running:
+                continue
+            try:
+                if now - os.stat(job_path).st_mtime < self.stale_job_seconds:
+                    continue
+                # Rename first, so two daemons never recover the same job
+                recovering = os.path.join(self.spool_dir, f".{name}.recovering")
+                os.rename(job_path, recovering)
+            except FileNotFoundError:
+                continue  # Finished, or recovered by another daemon
+
+            try:
+                with open(recovering, 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except ValueError:
+                job = None
+            if not isinstance(job, dict):
+                # Would fail anyway (or run with the daemon's own input dir), don't queue it again
+                job = {"job": self._read_raw(recovering), "error": "Abandoned by a stopped daemon, not a valid job"}
+                self._finish_job(recovering, "failed", job, name)
+                logging.error(f"Job {name} failed: {job['error']}")
+                continue
+            job["recovered"] = job.get("recovered", 0) + 1
+            if job["recovered"] > self.max_recoveries:
+                job["error"] = f"Abandoned by a stopped daemon {self.max_recoveries} times"
+                self._finish_job(recovering, "failed", job, name)
+                logging.error(f"Job {name} failed: {job['error']}")
+            else:
+                self._finish_job(recovering, "incoming", job, name)
+                logging.warning(f"Job {name} was abandoned by a stopped daemon, queued again")
+
+    def _run_job(self, job_path):
+        name = os.path.basename(job_path)
+        started = time.monotonic()
+        job = None
+        try:
+            with open(job_path, 'r', encoding='utf-8') as f:
+                job = json.load(f)
+            self.process_job(job)
+            job["elapsed_seconds"] = round(time.monotonic() - started, 3)
+            self._finish_job(job_path, "done", job)
+            logging.info(f"Job {name} done in {job['elapsed_seconds']}s")
+        except Exception as e:
+            logging.error(f"Job {name} failed: {e}")
+            # Keep the job itself, so it can be inspected and resubmitted from failed/
+            failed = {**job} if isinstance(job, dict) else {"job": self._read_raw(job_path)}
+            failed.update(error=str(e), traceback=traceback.format_exc())
+            self._finish_job(job_path, "failed", failed)
+
+    def _read_raw(self, job_path):
+        try:
+            with open(job_path, 'r', encoding='utf-8', errors='replace') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _finish_job(self, job_path, state, payload, name=None):
+        name = name or os.path.basename(job_path)
+        # Written aside and renamed, so daemons never claim a half written job from incoming/
+        tmp_path = os.path.join(self.spool_dir, f".{name}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.spool_dir, state, name))
+        os.remove(job_path)
+
+    def process_job(self, job):
+        config = copy.deepcopy(self.config)
+        apply_overrides(config, {key: job.get(key) for key in JOB_KEYS})
+
+        input_path = config.get("io.input_directory")
+        output_dir = config.get("io.output_directory")
+        ensure_directory(output_dir)
+        supported_ext = config.get("io.supported_extensions", [".docx", ".txt", ".md", ".pdf"])
+
+        if os.path.isfile(input_path):
+            documents = [input_path]
+        else:
+            documents = find_documents(input_path, supported_ext)
+        if not documents:
+            raise FileNotFoundError(f"No documents found in {input_path}")
+
+        output_format = config.get("processing.output_format", "txt")
+        add_section_title = config.get("processing.add_section_title", True)
+        docx_in_docx_mode = resolve_docx_in_docx_mode(documents, output_format)
+
+        # Parsers and processors are cheap to build; the expensive parts (client, tokenizer,
+        # processor modules) are shared. Per-job instances keep stateful processors isolated.
+        parser = create_parser(config)
+        ProcessorClass = self._processor_class(config.get("processing.processor", "Reviewer"))
+        processor = ProcessorClass(self.client, build_processor_parameters(config, docx_in_docx_mode))
+        results_store = create_results_store(config)
+        archiver = DocumentArchiver(output_dir, output_format, add_section_title, docx_in_docx_mode, results_store)
+
+        try:
+            for doc_path in documents:
+                process_document(doc_path, parser, processor, archiver, docx_in_docx_mode)
+        finally:
+            if results_store is not None:
+                results_store.close()
+
+    def _processor_class(self, name):
+        with self._processor_classes_lock:
+            if name not in self._processor_classes:
+                self._processor_classes[name] = load_processor_class(name)
+            return self._processor_classes[name]
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# The modules in src/ import each other as top-level modules, like when running src/main.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+class FakeClock:
+    """
+    Manually advanced clock, for deterministic tests of time-based behaviour.
+    """
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
@@ -0,0 +1,112 @@
+import threading
+import pytest
+from backend_pool import Backend, BackendPool
+from conftest import FakeClock
+
+def make_pool(*names, clock=None, max_concurrency=None):
+    max_concurrency = max_concurrency or {}
+    backends = [Backend(name, "test-key", "test-model", max_concurrency=max_concurrency.get(name))
+                for name in names]
+    return BackendPool(backends, failure_threshold=2, ejection_seconds=10.0, max_ejection_seconds=25.0,
+                       clock=clock or FakeClock())
+
+def send(backend):
+    # A request on a given backend, whichever one the pool would pick
+    backend.in_flight += 1
+    return backend
+
+def fail(pool, backend, times):
+    for _ in range(times):
+        pool.release(send(backend), False)
+
+def names(pool, count):
+    picked = [pool.acquire() for _ in range(count)]
+    for backend in picked:
+        pool.release(backend, True)
+    return [backend.name for backend in picked]
+
+def test_least_loaded_backend_is_picked():
+    pool = make_pool("a", "b")
+    first = pool.acquire()
+    second = pool.acquire()
+    assert {first.name, second.name} == {"a", "b"}
+
+def test_backend_ejected_after_consecutive_failures():
+    clock = FakeClock()
+    pool = make_pool("a", "b", clock=clock)
+    a = pool.backends[0]
+    fail(pool, a, 1)
+    assert a.ejected_until is None
+    fail(pool, a, 1)
+    assert a.ejected_until == clock() + 10.0
+    assert set(names(pool, 5)) == {"b"}
+
+def test_success_resets_failure_count():
+    pool = make_pool("a", "b")
+    a = pool.backends[0]
+    fail(pool, a, 1)
+    pool.release(send(a), True)
+    fail(pool, a, 1)
+    assert a.ejected_until is None
+
+def test_readmitted_on_probation_after_ejection():
+    clock = FakeClock()
+    pool = make_pool("a", "b", clock=clock)
+    a = pool.backends[0]
+    fail(pool, a, 2)
+    clock.advance(10.0)
+    picked = [pool.acquire(), pool.acquire()]
+    assert a in picked
+    # On probation: a single failure ejects it again, for twice as long
+    for backend in picked:
+        pool.release(backend, False)
+    assert a.ejected_until == clock() + 20.0
+    clock.advance(20.0)
+    fail(pool, a, 1)
+    assert a.ejected_until == clock() + 25.0  # Capped at max_ejection_seconds
+
+def test_success_on_probation_makes_backend_healthy():
+    clock = FakeClock()
+    pool = make_pool("a", "b", clock=clock)
+    a = pool.backends[0]
+    fail(pool, a, 2)
+    clock.advance(10.0)
+    pool.release(send(a), True)
+    assert a.ejections == 0
+    fail(pool, a, 1)
+    assert a.ejected_until is None
+
+def test_first_backend_back_is_used_when_all_are_ejected():
+    clock = FakeClock()
+    pool = make_pool("a", "b", clock=clock)
+    a, b = pool.backends
+    fail(pool, a, 2)
+    clock.advance(1.0)
+    fail(pool, b, 2)
+    assert names(pool, 3) == ["a", "a", "a"]
+
+def test_invalid_request_says_nothing_about_backend():
+    pool = make_pool("a")
+    a = pool.backends[0]
+    for _ in range(5):
+        pool.release(send(a), None)
+    assert a.consecutive_failures == 0
+
+def test_max_concurrency_is_a_hard_cap():
+    pool = make_pool("a", "b", max_concurrency={"a": 1, "b": 1})
+    first = pool.acquire()
+    second = pool.acquire()
+    assert {first.name, second.name} == {"a", "b"}
+
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    waiter.join(timeout=0.2)
+    assert waiter.is_alive() and not acquired  # Both backends full: waits
+    pool.release(second, True)
+    waiter.join(timeout=5)
+    assert [backend.name for backend in acquired] == [second.name]
+
+def test_max_concurrency_must_be_positive():
+    with pytest.raises(ValueError):
+        Backend("a", "test-key", "test-model", max_concurrency=0)
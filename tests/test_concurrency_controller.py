@@ -0,0 +1,72 @@
+from concurrency_controller import AdaptiveConcurrencyController, SUCCESS, THROTTLED, ERROR
+from conftest import FakeClock
+
+def make_controller(**kwargs):
+    return AdaptiveConcurrencyController(clock=FakeClock(), **kwargs)
+
+def run_request(controller, outcome, latency=0.1):
+    controller.release(controller.acquire(), outcome, latency)
+
+def test_successes_increase_limit_additively():
+    controller = make_controller(initial_limit=4, max_limit=64)
+    for _ in range(4):
+        run_request(controller, SUCCESS)
+    # One full window of successes (limit requests) adds about one slot
+    assert 4.9 < controller.limit < 5.0
+    for _ in range(200):
+        run_request(controller, SUCCESS)
+    assert controller.limit > 10
+
+def test_limit_stops_at_max_limit():
+    controller = make_controller(initial_limit=4, max_limit=6)
+    for _ in range(100):
+        run_request(controller, SUCCESS)
+    assert controller.limit == 6
+
+def test_throttling_decreases_limit_multiplicatively():
+    controller = make_controller(initial_limit=8, decrease_factor=0.5)
+    run_request(controller, THROTTLED)
+    assert controller.limit == 4
+    run_request(controller, THROTTLED)
+    assert controller.limit == 2
+
+def test_limit_stops_at_min_limit():
+    controller = make_controller(initial_limit=4, min_limit=2)
+    for _ in range(5):
+        run_request(controller, THROTTLED)
+    assert controller.limit == 2
+
+def test_one_decrease_per_congestion_episode():
+    controller = make_controller(initial_limit=8)
+    tickets = [controller.acquire() for _ in range(8)]
+    # A burst of 429s on requests started before the first decrease only counts once
+    for ticket in tickets:
+        controller.release(ticket, THROTTLED)
+    assert controller.limit == 4
+    # A request started after the decrease can trigger the next one
+    run_request(controller, THROTTLED)
+    assert controller.limit == 2
+
+def test_errors_leave_limit_unchanged():
+    controller = make_controller(initial_limit=4)
+    for _ in range(10):
+        run_request(controller, ERROR)
+    assert controller.limit == 4
+
+def test_latency_drift_counts_as_congestion():
+    controller = make_controller(initial_limit=16, max_limit=16, latency_tolerance=2.0)
+    for _ in range(20):
+        run_request(controller, SUCCESS, latency=0.1)
+    assert controller.limit == 16
+    # Two slow requests out of 22 bring the window's p95 to 10 times the best one seen
+    run_request(controller, SUCCESS, latency=1.0)
+    assert controller.limit == 16
+    run_request(controller, SUCCESS, latency=1.0)
+    assert controller.limit == 8
+
+def test_fixed_limit_when_not_adaptive():
+    controller = make_controller(initial_limit=3, adaptive=False)
+    run_request(controller, THROTTLED)
+    for _ in range(20):
+        run_request(controller, SUCCESS)
+    assert controller.limit == 3
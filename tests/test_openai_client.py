@@ -0,0 +1,37 @@
+import pytest
+from mock_openai_server import MockOpenAIServer
+from openai_client import OpenAIClient
+
+@pytest.fixture
+def make_server():
+    servers = []
+    def make(**kwargs):
+        server = MockOpenAIServer(**kwargs)
+        server.start()
+        servers.append(server)
+        return server
+    yield make
+    for server in servers:
+        server.stop()
+
+def test_completion_through_mock_server(make_server):
+    server = make_server(base_latency=0.0)
+    client = OpenAIClient("test-key", "test-model", base_url=server.base_url, max_concurrency=2)
+    details = {}
+    try:
+        assert "Hello" in client.get_completion("Translate", "Hello world", details=details)
+    finally:
+        client.close()
+    assert details["model"]
+    assert all(backend.in_flight == 0 for backend in client.backends.backends)
+
+def test_timeout_lowers_adaptive_limit(make_server):
+    server = make_server(base_latency=2.0)
+    client = OpenAIClient("test-key", "test-model", base_url=server.base_url, max_retries=1, max_concurrency=8,
+                          adaptive_concurrency=True, initial_concurrency=4, timeout_base_seconds=0.2)
+    try:
+        assert client.get_completion("Translate", "Hello") is None
+    finally:
+        client.close()
+    # A timed out request is congestion, like a 429
+    assert client.concurrency.limit == 2
@@ -0,0 +1,82 @@
+import pytest
+from work_queue import WorkQueue
+from conftest import FakeClock
+
+SECTIONS = [{"id": i, "title": f"Section {i}", "content": f"Text {i}"} for i in range(3)]
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), lease_seconds=60.0, max_attempts=2, clock=clock)
+    yield queue
+    queue.close()
+
+def enqueue(queue, sections=SECTIONS):
+    run_id = queue.create_run({"processor": "Reviewer", "processor_parameters": {}})
+    queue.add_document(run_id, "doc.docx", sections)
+    queue.close_run(run_id)
+    return run_id
+
+def test_leased_tasks_are_not_claimed_twice(queue):
+    enqueue(queue)
+    first = queue.claim("w1", 2)
+    second = queue.claim("w2", 10)
+    assert [t["section_id"] for t in first] == [0, 1]
+    assert [t["section_id"] for t in second] == [2]
+    assert queue.claim("w3", 10) == []
+
+def test_expired_lease_is_claimed_again(queue, clock):
+    enqueue(queue)
+    claimed = queue.claim("w1", 10)
+    clock.advance(59.0)
+    assert queue.claim("w2", 10) == []
+    clock.advance(2.0)
+    reclaimed = queue.claim("w2", 10)
+    assert [t["id"] for t in reclaimed] == [t["id"] for t in claimed]
+    assert all(t["requeued"] and t["attempts"] == 2 for t in reclaimed)
+
+def test_heartbeat_extends_lease(queue, clock):
+    enqueue(queue)
+    claimed = queue.claim("w1", 10)
+    clock.advance(50.0)
+    assert queue.heartbeat("w1", [t["id"] for t in claimed]) == len(claimed)
+    clock.advance(50.0)
+    assert queue.claim("w2", 10) == []
+
+def test_result_of_expired_lease_is_discarded(queue, clock):
+    enqueue(queue, SECTIONS[:1])
+    task = queue.claim("w1", 1)[0]
+    clock.advance(61.0)
+    queue.claim("w2", 1)
+    assert queue.complete("w1", [(task["id"], "late")]) == 0
+    assert queue.complete("w2", [(task["id"], "on time")]) == 1
+    assert queue.counts() == {"done": 1}
+
+def test_task_fails_after_max_attempts(queue, clock):
+    enqueue(queue, SECTIONS[:1])
+    queue.claim("w1", 1)
+    clock.advance(61.0)
+    queue.claim("w2", 1)
+    clock.advance(61.0)
+    assert queue.claim("w3", 1) == []
+    assert queue.counts() == {"failed": 1}
+
+def test_failed_attempt_is_retried(queue):
+    enqueue(queue, SECTIONS[:1])
+    task = queue.claim("w1", 1)[0]
+    assert queue.complete("w1", [(task["id"], None)]) == 1
+    retried = queue.claim("w2", 1)
+    assert [t["id"] for t in retried] == [task["id"]]
+    queue.complete("w2", [(task["id"], None)])
+    assert queue.counts() == {"failed": 1}
+
+def test_run_finished_once_all_tasks_are_done(queue):
+    run_id = enqueue(queue)
+    tasks = queue.claim("w1", 10)
+    assert not queue.run_finished(run_id)
+    queue.complete("w1", [(t["id"], {"content": t["content"].upper(), "model": "m"}) for t in tasks])
+    assert queue.run_finished(run_id)
+    assert queue.is_drained()